@@ -0,0 +1,153 @@
+import argparse
+import collections
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+from chess import BACKENDS, DEFAULT_HASH_MB, GameState, SearchStats
+
+def parse_epd(line):
+    # accepts both a full fen and an epd line, whose first four fields may be followed by
+    # operations like 'bm e4; id "pos 1";', returns the fen and the operations by name
+    fields = line.split(None, 4)
+    if len(fields) < 4:
+        raise ValueError("not a fen or epd position: %r" % line)
+    rest = fields[4] if len(fields) > 4 else ""
+    clocks = rest.split(None, 2)
+    if len(clocks) >= 2 and clocks[0].isdigit() and clocks[1].isdigit():
+        return " ".join(fields[:4]+clocks[:2]), {}
+    operations = {}
+    for operation in rest.split(";"):
+        operation = operation.strip()
+        if operation:
+            opcode, _, operand = operation.partition(" ")
+            operations[opcode] = operand.strip().strip('"')
+    fen = " ".join(fields[:4]+[operations.get("hmvc", "0"), operations.get("fmvn", "1")])
+    return fen, operations
+
+def read_positions(lines):
+    # lazily turns an iterable of fen/epd lines, like an open file, into (index, line) pairs,
+    # the index counts every non empty line so results can be matched up with the input
+    index = 0
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith("#"):
+            yield index, line
+            index += 1
+
+def analyse_position(state, index, line, limits):
+    result = {"index": index}
+    try:
+        fen, operations = parse_epd(line)
+        state.set_fen(fen)
+        state.check_position()
+    except (ValueError, IndexError) as error:
+        result.update(input=line, error=str(error) or "invalid position")
+        return result
+    if "id" in operations:
+        result["id"] = operations["id"]
+    result["fen"] = fen
+    start = time.perf_counter()
+    move, value, depth = state.search(**limits)
+    result.update(move=move or None, score=value, depth=depth, nodes=state.nodes,
+                  time=round(time.perf_counter()-start, 6))
+    if state.stats is not None:
+        result["stats"] = state.stats.as_dict()
+    return result
+
+_worker_state = None
+
+def _init_worker(hash_size_mb, backend, stats):
+    global _worker_state
+    _worker_state = GameState(hash_size_mb, backend)
+    _worker_state.stats = SearchStats() if stats else None
+
+def _analyse_chunk(chunk, limits):
+    return [analyse_position(_worker_state, index, line, limits) for index, line in chunk]
+
+def analyse(positions, workers=1, chunksize=16, hash_size_mb=DEFAULT_HASH_MB, backend=None, stats=False, **limits):
+    # streams the results of an iterable of (index, line) pairs in input order, only a few
+    # chunks per worker are read ahead so memory stays bounded however long the input is
+    positions = iter(positions)
+    chunks = iter(lambda: list(itertools.islice(positions, chunksize)), [])
+    if workers <= 1:
+        state = GameState(hash_size_mb, backend)
+        state.stats = SearchStats() if stats else None
+        for chunk in chunks:
+            for index, line in chunk:
+                yield analyse_position(state, index, line, limits)
+        return
+    with multiprocessing.Pool(workers, _init_worker, (hash_size_mb, backend, stats)) as pool:
+        pending = collections.deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(_analyse_chunk, (chunk, limits)))
+            if len(pending) >= 2*workers:
+                yield from pending.popleft().get()
+        while pending:
+            yield from pending.popleft().get()
+
+def completed_positions(path):
+    # counts the results already in an output file and cuts off a line left half written
+    # by an interrupted run, results are written in input order so that is where to resume
+    if not os.path.exists(path):
+        return 0
+    with open(path, "rb+") as f:
+        count = 0
+        end = 0
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            count += 1
+            end += len(line)
+        f.truncate(end)
+    return count
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Searches every position of fen/epd files and writes the results as json lines.")
+    parser.add_argument("input", nargs="*", help="fen/epd files, reads stdin if none are given")
+    parser.add_argument("-o", "--output", help="write the results to this file instead of stdout")
+    parser.add_argument("--resume", action="store_true", help="skip the positions already in the output file")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunksize", type=int, default=16, help="positions sent to a worker at once (default: 16)")
+    parser.add_argument("--hash", type=int, default=DEFAULT_HASH_MB, help="transposition table size per worker in MB")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="mailbox")
+    parser.add_argument("--depth", type=int)
+    parser.add_argument("--movetime", type=int, help="milliseconds per position")
+    parser.add_argument("--nodes", type=int)
+    parser.add_argument("--stats", action="store_true", help="add the search statistics to every result")
+    args = parser.parse_args(argv)
+    if args.resume and not args.output:
+        parser.error("--resume needs --output")
+    if args.depth is None and args.movetime is None and args.nodes is None:
+        args.depth = 4
+
+    files = [open(path) for path in args.input] or [sys.stdin]
+    positions = read_positions(itertools.chain.from_iterable(files))
+    skip = completed_positions(args.output) if args.resume else 0
+    positions = itertools.islice(positions, skip, None)
+    out = open(args.output, "a" if args.resume else "w") if args.output else sys.stdout
+    errors = 0
+    try:
+        results = analyse(positions, args.workers, args.chunksize, args.hash, args.backend, args.stats,
+                          depth=args.depth, movetime=args.movetime, nodes=args.nodes)
+        for count, result in enumerate(results, 1):
+            errors += "error" in result
+            out.write(json.dumps(result)+"\n")
+            if count % args.chunksize == 0:
+                out.flush()
+    except KeyboardInterrupt:
+        return 130
+    finally:
+        out.flush()
+        if out is not sys.stdout:
+            out.close()
+        for f in files:
+            if f is not sys.stdin:
+                f.close()
+    return 1 if errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +1,6 @@
+import struct
+import time
+
 WHITE_PAWN=1
 WHITE_KNIGHT=2
 WHITE_BISHOP=3
@@ -10,444 +13,1242 @@ BLACK_BISHOP=9
 BLACK_ROOK=10
 BLACK_QUEEN=11
 BLACK_KING=12
+OFFBOARD=13
 
 KNIGHT_MOVES = [[-2, -1], [+2, -1], [-2, +1], [+2, +1], [-1, -2], [+1, -2], [-1, +2], [+1, +2]]
 KING_MOVES = [[-1, -1], [0, -1], [+1, -1], [-1, 0], [+1, 0], [-1, +1], [0, +1], [+1, +1]]
 BISHOP_DIRECTIONS = [[-1, -1], [-1, +1], [+1, -1], [+1, +1]]
+ROOK_DIRECTIONS = [[-1, 0], [+1, 0], [0, -1], [0, +1]]
 
-eval_table = {}
+# the board is a 10x12 mailbox: a1 is 21, h8 is 98 and the files and ranks
+# around the board hold OFFBOARD, so stepping off the board needs no bounds check
+KNIGHT_OFFSETS = [dx+10*dy for dx, dy in KNIGHT_MOVES]
+KING_OFFSETS = [dx+10*dy for dx, dy in KING_MOVES]
+BISHOP_OFFSETS = [dx+10*dy for dx, dy in BISHOP_DIRECTIONS]
+ROOK_OFFSETS = [dx+10*dy for dx, dy in ROOK_DIRECTIONS]
+QUEEN_OFFSETS = KING_OFFSETS
 
-def copy_board(old_board):
-    return [[old_board[x][y] for y in range(8)] for x in range(8)]
+def square(x, y):
+    return 21+x+10*y
 
-class GameState:
+SQUARES = [square(x, y) for y in range(8) for x in range(8)]
+SQUARE_NAMES = ['']*120
+for _x in range(8):
+    for _y in range(8):
+        SQUARE_NAMES[square(_x, _y)] = chr(_x+97)+str(_y+1)
+SQUARE_INDEX = {name: sq for sq, name in enumerate(SQUARE_NAMES) if name}
+
+A1, C1, D1, E1, F1, G1, H1 = [square(x, 0) for x in (0, 2, 3, 4, 5, 6, 7)]
+A8, C8, D8, E8, F8, G8, H8 = [square(x, 7) for x in (0, 2, 3, 4, 5, 6, 7)]
+
+IS_WHITE = [0 < piece <= WHITE_KING for piece in range(14)]
+IS_BLACK = [BLACK_PAWN <= piece <= BLACK_KING for piece in range(14)]
+
+WHITE_KINGSIDE=1
+WHITE_QUEENSIDE=2
+BLACK_KINGSIDE=4
+BLACK_QUEENSIDE=8
+CASTLING_MASK = [15]*120
+CASTLING_MASK[A1] = 15 & ~WHITE_QUEENSIDE
+CASTLING_MASK[E1] = 15 & ~(WHITE_KINGSIDE | WHITE_QUEENSIDE)
+CASTLING_MASK[H1] = 15 & ~WHITE_KINGSIDE
+CASTLING_MASK[A8] = 15 & ~BLACK_QUEENSIDE
+CASTLING_MASK[E8] = 15 & ~(BLACK_KINGSIDE | BLACK_QUEENSIDE)
+CASTLING_MASK[H8] = 15 & ~BLACK_KINGSIDE
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+FEN_PIECES = {c: piece for piece, c in enumerate(' PNBRQKpnbrqk') if piece}
+FEN_CASTLING = {'K': WHITE_KINGSIDE, 'Q': WHITE_QUEENSIDE, 'k': BLACK_KINGSIDE, 'q': BLACK_QUEENSIDE, '-': 0}
+FEN_CASTLING_NAMES = ['-' if not rights else ''.join(c for c, flag in FEN_CASTLING.items() if rights & flag) for rights in range(16)]
+FEN_RANKS = [[square(x, y) for x in range(8)] for y in reversed(range(8))]
+FEN_SQUARES = [sq for rank_squares in FEN_RANKS for sq in rank_squares]
+
+# moves are packed into ints: 7 bits source square, 7 bits destination square,
+# 4 bits promotion piece and the special move flags above those
+MOVE_EN_PASSANT = 1 << 18
+MOVE_DOUBLE_PUSH = 2 << 18
+MOVE_CASTLE = 4 << 18
+MOVE_FLAGS = 7 << 18
+# promotions and en passant captures, searched by quiescence next to ordinary captures
+MOVE_TACTICAL = 15 << 14 | MOVE_EN_PASSANT
+
+WHITE_PROMOTIONS = [WHITE_QUEEN, WHITE_ROOK, WHITE_BISHOP, WHITE_KNIGHT]
+BLACK_PROMOTIONS = [BLACK_QUEEN, BLACK_ROOK, BLACK_BISHOP, BLACK_KNIGHT]
+PROMOTION_NAMES = ' pnbrqkpnbrqk'
+
+PIECE_VALUES = [0, 100, 320, 330, 500, 900, 0, -100, -320, -330, -500, -900, 0, 0]
+MATE_VALUE = 100000
+
+# piece-square tables from white's point of view, written with the 8th rank on top
+PAWN_TABLE = [ 0,  0,  0,  0,  0,  0,  0,  0,
+              50, 50, 50, 50, 50, 50, 50, 50,
+              10, 10, 20, 30, 30, 20, 10, 10,
+               5,  5, 10, 25, 25, 10,  5,  5,
+               0,  0,  0, 20, 20,  0,  0,  0,
+               5, -5,-10,  0,  0,-10, -5,  5,
+               5, 10, 10,-20,-20, 10, 10,  5,
+               0,  0,  0,  0,  0,  0,  0,  0]
+KNIGHT_TABLE = [-50,-40,-30,-30,-30,-30,-40,-50,
+                -40,-20,  0,  0,  0,  0,-20,-40,
+                -30,  0, 10, 15, 15, 10,  0,-30,
+                -30,  5, 15, 20, 20, 15,  5,-30,
+                -30,  0, 15, 20, 20, 15,  0,-30,
+                -30,  5, 10, 15, 15, 10,  5,-30,
+                -40,-20,  0,  5,  5,  0,-20,-40,
+                -50,-40,-30,-30,-30,-30,-40,-50]
+BISHOP_TABLE = [-20,-10,-10,-10,-10,-10,-10,-20,
+                -10,  0,  0,  0,  0,  0,  0,-10,
+                -10,  0,  5, 10, 10,  5,  0,-10,
+                -10,  5,  5, 10, 10,  5,  5,-10,
+                -10,  0, 10, 10, 10, 10,  0,-10,
+                -10, 10, 10, 10, 10, 10, 10,-10,
+                -10,  5,  0,  0,  0,  0,  5,-10,
+                -20,-10,-10,-10,-10,-10,-10,-20]
+ROOK_TABLE = [ 0,  0,  0,  0,  0,  0,  0,  0,
+               5, 10, 10, 10, 10, 10, 10,  5,
+              -5,  0,  0,  0,  0,  0,  0, -5,
+              -5,  0,  0,  0,  0,  0,  0, -5,
+              -5,  0,  0,  0,  0,  0,  0, -5,
+              -5,  0,  0,  0,  0,  0,  0, -5,
+              -5,  0,  0,  0,  0,  0,  0, -5,
+               0,  0,  0,  5,  5,  0,  0,  0]
+QUEEN_TABLE = [-20,-10,-10, -5, -5,-10,-10,-20,
+               -10,  0,  0,  0,  0,  0,  0,-10,
+               -10,  0,  5,  5,  5,  5,  0,-10,
+                -5,  0,  5,  5,  5,  5,  0, -5,
+                 0,  0,  5,  5,  5,  5,  0, -5,
+               -10,  5,  5,  5,  5,  5,  0,-10,
+               -10,  0,  5,  0,  0,  0,  0,-10,
+               -20,-10,-10, -5, -5,-10,-10,-20]
+KING_TABLE = [-30,-40,-40,-50,-50,-40,-40,-30,
+              -30,-40,-40,-50,-50,-40,-40,-30,
+              -30,-40,-40,-50,-50,-40,-40,-30,
+              -30,-40,-40,-50,-50,-40,-40,-30,
+              -20,-30,-30,-40,-40,-30,-30,-20,
+              -10,-20,-20,-20,-20,-20,-20,-10,
+               20, 20,  0,  0,  0,  0, 20, 20,
+               20, 30, 10,  0,  0, 10, 30, 20]
+
+# PIECE_SQUARE_VALUES[piece][sq] is the material and placement score of a piece, positive for white
+PIECE_SQUARE_VALUES = [[0]*120 for _ in range(14)]
+for _piece, _table in enumerate([PAWN_TABLE, KNIGHT_TABLE, BISHOP_TABLE, ROOK_TABLE, QUEEN_TABLE, KING_TABLE], 1):
+    for _x in range(8):
+        for _y in range(8):
+            PIECE_SQUARE_VALUES[_piece][square(_x, _y)] = PIECE_VALUES[_piece]+_table[(7-_y)*8+_x]
+            PIECE_SQUARE_VALUES[_piece+6][square(_x, _y)] = PIECE_VALUES[_piece+6]-_table[_y*8+_x]
+# victim and attacker values for ordering captures, the king is the cheapest attacker to try last
+ORDERING_VALUES = [0, 1, 3, 3, 5, 9, 10, 1, 3, 3, 5, 9, 10, 0]
+
+# tables for the bitboard backend, which numbers the squares 0 (a1) to 63 (h8)
+SQ120 = list(SQUARES)
+SQ64 = [-1]*120
+for _i, _sq in enumerate(SQUARES):
+    SQ64[_sq] = _i
+
+BITS = [1 << _i if _i >= 0 else 0 for _i in SQ64]
+BITBOARD_FULL = (1 << 64)-1
+FILE_A = sum(1 << (8*_y) for _y in range(8))
+FILE_H = FILE_A << 7
+RANK_3 = 0xFF << 16
+RANK_6 = 0xFF << 40
+PROMOTION_RANKS = 0xFF | 0xFF << 56
+
+def offsets_to_bitboards(offsets):
+    attacks = []
+    for sq in SQUARES:
+        bitboard = 0
+        for offset in offsets:
+            if SQ64[sq+offset] >= 0:
+                bitboard |= 1 << SQ64[sq+offset]
+        attacks.append(bitboard)
+    return attacks
+
+KNIGHT_ATTACKS = offsets_to_bitboards(KNIGHT_OFFSETS)
+KING_ATTACKS = offsets_to_bitboards(KING_OFFSETS)
+WHITE_PAWN_ATTACKS = offsets_to_bitboards([9, 11])
+BLACK_PAWN_ATTACKS = offsets_to_bitboards([-9, -11])
+
+# RAYS[offset][sq] holds every square from sq towards the edge of the board
+RAYS = {}
+for _offset in QUEEN_OFFSETS:
+    RAYS[_offset] = []
+    for _sq in SQUARES:
+        _ray = 0
+        _target = _sq+_offset
+        while SQ64[_target] >= 0:
+            _ray |= 1 << SQ64[_target]
+            _target += _offset
+        RAYS[_offset].append(_ray)
+BISHOP_RAYS = [(RAYS[offset], offset > 0) for offset in BISHOP_OFFSETS]
+ROOK_RAYS = [(RAYS[offset], offset > 0) for offset in ROOK_OFFSETS]
+BETWEEN = [[0]*64 for _ in range(64)]
+for _offset in QUEEN_OFFSETS:
+    for _sq in SQUARES:
+        _between = 0
+        _target = _sq+_offset
+        while SQ64[_target] >= 0:
+            BETWEEN[SQ64[_sq]][SQ64[_target]] = _between
+            _between |= 1 << SQ64[_target]
+            _target += _offset
+
+def slider_attacks(sq, occupied, rays):
+    # the first blocker on a ray is its lowest bit when the ray points up the board
+    attacks = 0
+    for ray_table, ascending in rays:
+        ray = ray_table[sq]
+        blockers = ray & occupied
+        if blockers:
+            if ascending:
+                ray ^= ray_table[(blockers & -blockers).bit_length()-1]
+            else:
+                ray ^= ray_table[blockers.bit_length()-1]
+        attacks |= ray
+    return attacks
+
+def bishop_attacks(sq, occupied):
+    return slider_attacks(sq, occupied, BISHOP_RAYS)
+
+def rook_attacks(sq, occupied):
+    return slider_attacks(sq, occupied, ROOK_RAYS)
+
+BISHOP_LINES = [bishop_attacks(_sq, 0) for _sq in range(64)]
+ROOK_LINES = [rook_attacks(_sq, 0) for _sq in range(64)]
+
+def encode_move(src, dst, promotion=0, flags=0):
+    return src | dst << 7 | promotion << 14 | flags
+
+def move_to_uci(move):
+    promotion = move >> 14 & 15
+    return SQUARE_NAMES[move & 127]+SQUARE_NAMES[move >> 7 & 127]+(PROMOTION_NAMES[promotion] if promotion else '')
+
+def random_numbers(seed):
+    # splitmix64, so the zobrist keys are the same on every run without importing random
+    mask = (1 << 64)-1
+    while True:
+        seed = (seed+0x9E3779B97F4A7C15) & mask
+        z = seed
+        z = ((z ^ (z >> 30))*0xBF58476D1CE4E5B9) & mask
+        z = ((z ^ (z >> 27))*0x94D049BB133111EB) & mask
+        yield z ^ (z >> 31)
+
+_random = random_numbers(2024)
+ZOBRIST_PIECES = [[next(_random) if piece and piece != OFFBOARD else 0 for sq in range(120)] for piece in range(14)]
+ZOBRIST_BLACK_TO_MOVE = next(_random)
+_castling_keys = [next(_random) for _ in range(4)]
+ZOBRIST_CASTLING = [0]*16
+for _rights in range(16):
+    for _i in range(4):
+        if _rights & (1 << _i):
+            ZOBRIST_CASTLING[_rights] ^= _castling_keys[_i]
+_file_keys = [next(_random) for _ in range(8)]
+ZOBRIST_EN_PASSANT = [0]*120
+for _sq in SQUARES:
+    ZOBRIST_EN_PASSANT[_sq] = _file_keys[(_sq-21)%10]
+
+# occupancy of a1..h8, side to move | castling rights << 1, en passant square+1, halfmove clock,
+# fullmove number and one nibble per piece in the order of the occupied squares, 32 bytes in total
+PACKED_POSITION = struct.Struct('<QBBHH16s2x')
+
+def castling_flag(flag):
+    def get(self):
+        return self.castling_rights & flag != 0
+    def set(self, value):
+        rights = self.castling_rights | flag if value else self.castling_rights & ~flag
+        self.hash ^= ZOBRIST_CASTLING[self.castling_rights] ^ ZOBRIST_CASTLING[rights]
+        self.castling_rights = rights
+    return property(get, set)
+
+EXACT=0
+LOWER_BOUND=1
+UPPER_BOUND=2
+
+DEFAULT_HASH_MB = 16
+# rough memory cost of one filled slot: the list pointer, the entry tuple and its ints
+TT_ENTRY_BYTES = 160
+
+class TranspositionTable:
+
+    def __init__(self, size_mb=DEFAULT_HASH_MB):
+        self.resize(size_mb)
+
+    def resize(self, size_mb):
+        self.size_mb = size_mb
+        self.size = max(1, int(size_mb*1024*1024) // TT_ENTRY_BYTES)
+        self.clear()
+
+    def clear(self):
+        self.entries = [None]*self.size
+        self.generation = 0
+
+    def new_search(self):
+        self.generation += 1
+
+    def probe(self, hash):
+        entry = self.entries[hash % self.size]
+        if entry is not None and entry[0] == hash:
+            return entry
+        return None
+
+    def store(self, hash, depth, score, bound, move):
+        # depth-preferred, but entries left over from an earlier search are always replaced
+        index = hash % self.size
+        entry = self.entries[index]
+        if entry is None or entry[0] == hash or depth >= entry[1] or entry[5] != self.generation:
+            if not move and entry is not None and entry[0] == hash:
+                move = entry[4]
+            self.entries[index] = (hash, depth, score, bound, move, self.generation)
+
+MAX_PLY = 128
+MATE_THRESHOLD = MATE_VALUE-MAX_PLY
+# budgets are in milliseconds, like the uci go command
+DEFAULT_MOVES_TO_GO = 30
+MOVE_OVERHEAD_MS = 20
+
+class SearchTimeout(Exception):
+    pass
+
+class SearchStats:
+    # opt-in counters and timings of a search, set GameState.stats to an instance to collect them
 
     def __init__(self):
-        self.board =   [[4, 1, 0, 0, 0, 0, 7, 10],
-                        [2, 1, 0, 0, 0, 0, 7, 8],
-                        [3, 1, 0, 0, 0, 0, 7, 9],
-                        [5, 1, 0, 0, 0, 0, 7, 11],
-                        [6, 1, 0, 0, 0, 0, 7, 12],
-                        [3, 1, 0, 0, 0, 0, 7, 9],
-                        [2, 1, 0, 0, 0, 0, 7, 8],
-                        [4, 1, 0, 0, 0, 0, 7, 10]]
+        self.reset()
+
+    def reset(self):
+        self.nodes = 0
+        self.qnodes = 0
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+        self.tt_probes = 0
+        self.tt_hits = 0
+        self.tt_collisions = 0
+        self.movegen_time = 0.0
+        self.legality_time = 0.0
+        self.make_unmake_time = 0.0
+        self.time = 0.0
+        self.iterations = []
+        self.last_totals = (0, 0, 0, 0)
+
+    @property
+    def first_move_cutoff_ratio(self):
+        return self.first_move_cutoffs/self.cutoffs if self.cutoffs else 0.0
+
+    @property
+    def tt_hit_rate(self):
+        return self.tt_hits/self.tt_probes if self.tt_probes else 0.0
+
+    def end_iteration(self, depth, nodes, elapsed):
+        last_nodes, last_qnodes, last_cutoffs, last_first_move_cutoffs = self.last_totals
+        cutoffs = self.cutoffs-last_cutoffs
+        iteration = {
+            "depth": depth,
+            "nodes": nodes-last_nodes,
+            "qnodes": self.qnodes-last_qnodes,
+            "cutoffs": cutoffs,
+            "first_move_cutoff_ratio": (self.first_move_cutoffs-last_first_move_cutoffs)/cutoffs if cutoffs else 0.0,
+            # nodes of this iteration for every node of the one before, the effective branching factor
+            "branching_factor": (nodes-last_nodes)/self.iterations[-1]["nodes"] if self.iterations and self.iterations[-1]["nodes"] else None,
+            "time": elapsed,
+        }
+        self.iterations.append(iteration)
+        self.last_totals = (nodes, self.qnodes, self.cutoffs, self.first_move_cutoffs)
+        return iteration
+
+    def as_dict(self):
+        return {
+            "nodes": self.nodes,
+            "qnodes": self.qnodes,
+            "cutoffs": self.cutoffs,
+            "first_move_cutoff_ratio": self.first_move_cutoff_ratio,
+            "tt_probes": self.tt_probes,
+            "tt_hits": self.tt_hits,
+            "tt_collisions": self.tt_collisions,
+            "tt_hit_rate": self.tt_hit_rate,
+            "movegen_time": self.movegen_time,
+            "legality_time": self.legality_time,
+            "make_unmake_time": self.make_unmake_time,
+            "time": self.time,
+            "iterations": list(self.iterations),
+        }
+
+# mate scores are stored relative to the node, so they stay correct when the position is reached at another ply
+def score_to_table(score, ply):
+    if score >= MATE_THRESHOLD:
+        return score+ply
+    if score <= -MATE_THRESHOLD:
+        return score-ply
+    return score
+
+def score_from_table(score, ply):
+    if score >= MATE_THRESHOLD:
+        return score-ply
+    if score <= -MATE_THRESHOLD:
+        return score+ply
+    return score
+
+class GameState:
+
+    def __new__(cls, hash_size_mb=DEFAULT_HASH_MB, backend=None):
+        if backend is not None:
+            cls = BACKENDS[backend]
+        return object.__new__(cls)
+
+    def __init__(self, hash_size_mb=DEFAULT_HASH_MB, backend=None):
+        self.board = [OFFBOARD]*120
+        for x, piece in enumerate([WHITE_ROOK, WHITE_KNIGHT, WHITE_BISHOP, WHITE_QUEEN, WHITE_KING, WHITE_BISHOP, WHITE_KNIGHT, WHITE_ROOK]):
+            self.board[square(x, 0)] = piece
+            self.board[square(x, 1)] = WHITE_PAWN
+            for y in range(2, 6):
+                self.board[square(x, y)] = 0
+            self.board[square(x, 6)] = BLACK_PAWN
+            self.board[square(x, 7)] = piece+6
 
         self.unicode_pieces = ' ♙♘♗♖♕♔♟♞♝♜♛♚'
         self.pieces = ' PNBRQKpnbrqk'
         self.is_whites_turn         = True
-        self.white_castle_kingside  = True
-        self.white_castle_queenside = True
-        self.black_castle_kingside  = True
-        self.black_castle_queenside = True
-        self.en_passant_oppertunity = '-'
+        self.castling_rights        = 15
+        self.en_passant_square      = 0
         self.halfmove_clock         = 0
         self.fullmove_num           = 1
+        self.hash = self.compute_hash()
+        self.score = self.compute_score()
         self.past_states = dict()
-        self.past_states[' '.join(self.to_fen().split()[:4])]=1
+        self.undo_stack = []
+        self.past_states[self.hash]=1
+        self.transposition_table = TranspositionTable(hash_size_mb)
+        # an opening book with a choose_move(state, searchmoves) method, like book.OpeningBook
+        self.book = None
+        # endgame tables with probe_score(state, ply) and best_move(state), like tablebase.Tablebases
+        self.tablebases = None
+        # a SearchStats to fill during searches, None keeps the search free of any bookkeeping
+        self.stats = None
+        self.killers = [[0, 0] for _ in range(MAX_PLY)]
+        self.history = [[0]*120 for _ in range(14)]
+        self.stop_search = False
+        self.stop_event = None
+        self.root_moves = None
+        self.deadline = None
+        self.node_limit = None
+        self.search_depth = 0
+        self.nodes = 0
+
+    white_castle_kingside  = castling_flag(WHITE_KINGSIDE)
+    white_castle_queenside = castling_flag(WHITE_QUEENSIDE)
+    black_castle_kingside  = castling_flag(BLACK_KINGSIDE)
+    black_castle_queenside = castling_flag(BLACK_QUEENSIDE)
+
+    @property
+    def en_passant_oppertunity(self):
+        return SQUARE_NAMES[self.en_passant_square] if self.en_passant_square else '-'
+
+    @en_passant_oppertunity.setter
+    def en_passant_oppertunity(self, name):
+        self.hash ^= ZOBRIST_EN_PASSANT[self.en_passant_square]
+        self.en_passant_square = 0 if name == '-' else square(ord(name[0])-97, int(name[1])-1)
+        self.hash ^= ZOBRIST_EN_PASSANT[self.en_passant_square]
+
+    def compute_hash(self):
+        hash = 0
+        for sq in SQUARES:
+            hash ^= ZOBRIST_PIECES[self.board[sq]][sq]
+        if not self.is_whites_turn:
+            hash ^= ZOBRIST_BLACK_TO_MOVE
+        return hash ^ ZOBRIST_CASTLING[self.castling_rights] ^ ZOBRIST_EN_PASSANT[self.en_passant_square]
+
+    def compute_score(self):
+        score = 0
+        for sq in SQUARES:
+            score += PIECE_SQUARE_VALUES[self.board[sq]][sq]
+        return score
 
-            
     def pretty_print(self, unicode=False):
         print(' '+'-'*8+' ')
         for x in range(0, 8)[::-1]:
             row='|'
             for y in range(0, 8):
                 if unicode:
-                    row += self.unicode_pieces[self.board[y][x]]
+                    row += self.unicode_pieces[self.board[square(y, x)]]
                 else:
-                    row += self.pieces[self.board[y][x]]
+                    row += self.pieces[self.board[square(y, x)]]
             row+='|'
             print(row.replace(' ', '.'))
         print(' '+'-'*8+' ')
 
     def to_fen(self):
-        fen=""
-        empty_counter=0
-        for y in reversed(range(8)):
-            for x in range(8):
-                if not self.is_empty(x, y):
-                    fen+='' if empty_counter == 0 else str(empty_counter)
-                    fen+=self.pieces[self.board[x][y]]
-                    empty_counter=0
+        board = self.board
+        pieces = self.pieces
+        ranks = []
+        for rank_squares in FEN_RANKS:
+            rank = []
+            empty = 0
+            for sq in rank_squares:
+                piece = board[sq]
+                if piece:
+                    if empty:
+                        rank.append(str(empty))
+                        empty = 0
+                    rank.append(pieces[piece])
                 else:
-                    empty_counter+=1
-            fen+='' if empty_counter == 0 else str(empty_counter)
-            fen+='/'
-            empty_counter=0
-        fen = fen[0:-1]
-        fen += ' '
-        fen += 'w' if self.is_whites_turn else 'b'
-        fen += ' '
-        fen += 'K'*self.white_castle_kingside
-        fen += 'Q'*self.white_castle_queenside
-        fen += 'k'*self.black_castle_kingside
-        fen += 'q'*self.black_castle_queenside
-        fen += '-'*(not any([self.white_castle_kingside, self.white_castle_queenside, self.black_castle_kingside, self.black_castle_queenside]))
-        fen += ' '
-        fen += self.en_passant_oppertunity
-        fen += ' '
-        fen += str(self.halfmove_clock)
-        fen += ' '
-        fen += str(self.fullmove_num)
-        return fen
-    
+                    empty += 1
+            if empty:
+                rank.append(str(empty))
+            ranks.append(''.join(rank))
+        return '%s %s %s %s %d %d' % ('/'.join(ranks), 'w' if self.is_whites_turn else 'b', FEN_CASTLING_NAMES[self.castling_rights],
+                                      self.en_passant_oppertunity, self.halfmove_clock, self.fullmove_num)
+
     def set_fen(self, fen):
-        groups=fen.split(' ')
-        for c in groups[0]:
-            for i in range(1, 9):
-                if c.isdigit():
-                    if int(c)==i:
-                        groups[0]=groups[0].replace(c, ' '*i)
-        groups[0]=groups[0].replace('/', '')
-        for y in reversed(range(8)):
-            for x in range(8):
-                self.board[x][y]=self.pieces.index(groups[0][(7-y)*8+x])
-        self.is_whites_turn = True if groups[1] == 'w' else False
-        self.white_castle_kingside  = 'K' in groups[2]
-        self.white_castle_queenside = 'Q' in groups[2]
-        self.black_castle_kingside  = 'k' in groups[2]
-        self.black_castle_queenside = 'q' in groups[2]
-        self.en_passant_oppertunity = groups[3]
-        self.halfmove_clock = int(groups[4])
-        self.fullmove_num = int(groups[5])
-    
+        # the move counters may be left out, like in epd
+        fields = fen.split()
+        if len(fields) not in (4, 6) or fields[1] not in ('w', 'b'):
+            raise ValueError("invalid fen: "+fen)
+        # everything is parsed and checked before the position is touched, a bad fen leaves it as it was
+        ranks = fields[0].split('/')
+        if len(ranks) != 8:
+            raise ValueError("invalid fen: "+fen)
+        pieces = []
+        for y, rank in enumerate(ranks, 1):
+            for c in rank:
+                if c in '12345678':
+                    pieces.extend([0]*int(c))
+                elif c in FEN_PIECES:
+                    pieces.append(FEN_PIECES[c])
+                else:
+                    raise ValueError("invalid fen: "+fen)
+            if len(pieces) != 8*y:
+                raise ValueError("invalid fen: "+fen)
+        castling_rights = 0
+        for c in fields[2]:
+            if c not in FEN_CASTLING:
+                raise ValueError("invalid fen: "+fen)
+            castling_rights |= FEN_CASTLING[c]
+        if fields[3] != '-' and fields[3] not in SQUARE_INDEX:
+            raise ValueError("invalid fen: "+fen)
+        halfmove_clock, fullmove_num = (int(fields[4]), int(fields[5])) if len(fields) == 6 else (0, 1)
+        if halfmove_clock < 0 or fullmove_num < 0:
+            raise ValueError("invalid fen: "+fen)
+        board = self.board
+        for sq, piece in zip(FEN_SQUARES, pieces):
+            board[sq] = piece
+        self.is_whites_turn = fields[1] == 'w'
+        self.castling_rights = castling_rights
+        self.en_passant_square = SQUARE_INDEX.get(fields[3], 0)
+        self.halfmove_clock, self.fullmove_num = halfmove_clock, fullmove_num
+        self.reset_history()
+
+    def to_packed(self):
+        # a fixed size binary encoding, see PACKED_POSITION
+        board = self.board
+        occupancy = 0
+        pieces = 0
+        shift = 0
+        for i, sq in enumerate(SQUARES):
+            if board[sq]:
+                occupancy |= 1 << i
+                pieces |= board[sq] << shift
+                shift += 4
+        if shift > 128:
+            raise ValueError("more than 32 pieces can't be packed")
+        return PACKED_POSITION.pack(occupancy, (not self.is_whites_turn) | self.castling_rights << 1,
+                                    SQ64[self.en_passant_square]+1 if self.en_passant_square else 0,
+                                    min(self.halfmove_clock, 0xFFFF), min(self.fullmove_num, 0xFFFF), pieces.to_bytes(16, 'little'))
+
+    def set_packed(self, buffer, offset=0):
+        occupancy, flags, en_passant, halfmove_clock, fullmove_num, pieces = PACKED_POSITION.unpack_from(buffer, offset)
+        pieces = int.from_bytes(pieces, 'little')
+        board = self.board
+        for sq in SQUARES:
+            board[sq] = 0
+        while occupancy:
+            bit = occupancy & -occupancy
+            occupancy ^= bit
+            if not 0 < pieces & 15 <= BLACK_KING:
+                raise ValueError("invalid packed position")
+            board[SQ120[bit.bit_length()-1]] = pieces & 15
+            pieces >>= 4
+        self.is_whites_turn = not flags & 1
+        self.castling_rights = flags >> 1 & 15
+        self.en_passant_square = SQ120[en_passant-1] if en_passant else 0
+        self.halfmove_clock = halfmove_clock
+        self.fullmove_num = fullmove_num
+        self.reset_history()
+
+    def reset_history(self):
+        # called once a new position is set up, the game that led to it is forgotten
+        self.hash = self.compute_hash()
+        self.score = self.compute_score()
+        self.past_states = {self.hash: 1}
+        self.undo_stack = []
+
     def index_to_name(self, x, y):
         return chr(x+97)+str(y+1)
-        
+
     def is_white_piece(self, x, y):
-        return self.board[x][y] <= 6 and self.board[x][y] != 0
-    
+        return IS_WHITE[self.board[square(x, y)]]
+
     def is_black_piece(self, x, y):
-        return self.board[x][y] >= 7
-        
+        return IS_BLACK[self.board[square(x, y)]]
+
     def is_empty(self, x, y):
-        return self.board[x][y] == 0
-    
+        return self.board[square(x, y)] == 0
+
     def is_on_board(self, x, y):
         return ((x >= 0 and x <= 7) and (y >= 0 and y <= 7))
-        
+
+    def parse_move(self, name):
+        for move in self.generate_moves():
+            if move_to_uci(move) == name:
+                return move
+        raise ValueError("not a valid move in this position: "+name)
+
     def is_in_check(self):
-        next_state=GameState()
-        next_state.white_castle_kingside=self.white_castle_kingside
-        next_state.white_castle_queenside=self.white_castle_queenside
-        next_state.black_castle_kingside=self.black_castle_kingside
-        next_state.black_castle_queenside=self.black_castle_queenside
-        next_state.board=copy_board(self.board)
-        next_state.is_whites_turn=not self.is_whites_turn
-        for next_move in next_state.next_moves():
-            dst_col = ord(next_move[2])-97
-            dst_row = int(next_move[3])-1
-            if self.board[dst_col][dst_row] == (WHITE_KING if self.is_whites_turn else BLACK_KING):
+        return self.is_king_attacked(self.is_whites_turn)
+
+    def is_king_attacked(self, white_king):
+        return self.is_square_attacked(self.board.index(WHITE_KING if white_king else BLACK_KING), not white_king)
+
+    def check_position(self):
+        # a fen can describe positions the search can't handle, raises a ValueError for those
+        if self.board.count(WHITE_KING) != 1 or self.board.count(BLACK_KING) != 1:
+            raise ValueError("each side needs exactly one king")
+        if self.is_king_attacked(not self.is_whites_turn):
+            raise ValueError("the side not to move is in check")
+
+    def is_square_attacked(self, sq, by_white):
+        # looks outward from the square for a piece that could capture on it
+        board = self.board
+        if by_white:
+            if board[sq-9] == WHITE_PAWN or board[sq-11] == WHITE_PAWN:
+                return True
+            knight, bishop, rook, queen, king = WHITE_KNIGHT, WHITE_BISHOP, WHITE_ROOK, WHITE_QUEEN, WHITE_KING
+        else:
+            if board[sq+9] == BLACK_PAWN or board[sq+11] == BLACK_PAWN:
+                return True
+            knight, bishop, rook, queen, king = BLACK_KNIGHT, BLACK_BISHOP, BLACK_ROOK, BLACK_QUEEN, BLACK_KING
+        for offset in KNIGHT_OFFSETS:
+            if board[sq+offset] == knight:
+                return True
+        for offset in KING_OFFSETS:
+            if board[sq+offset] == king:
+                return True
+        for offset in BISHOP_OFFSETS:
+            target = sq+offset
+            while board[target] == 0:
+                target += offset
+            if board[target] == bishop or board[target] == queen:
+                return True
+        for offset in ROOK_OFFSETS:
+            target = sq+offset
+            while board[target] == 0:
+                target += offset
+            if board[target] == rook or board[target] == queen:
                 return True
         return False
 
-    def execute_move(self, move):
-        if self.is_whites_turn:
-            self.fullmove_num += 1
-        self.halfmove_clock += 1
-        self.en_passant_oppertunity = '-'
-        src_col = ord(move[0])-96-1
-        src_row = int(move[1])-1
-        dst_col = ord(move[2])-96-1
-        dst_row = int(move[3])-1
-        if self.board[dst_col][dst_row] != 0:
-            self.halfmove_clock = 0
-        self.board[dst_col][dst_row] = self.board[src_col][src_row]
-        self.board[src_col][src_row] = 0
-        moved_piece=self.board[dst_col][dst_row]
-        if moved_piece == WHITE_PAWN:
+    def make_move(self, move):
+        if type(move) is str:
+            move = self.parse_move(move)
+        board = self.board
+        src = move & 127
+        dst = move >> 7 & 127
+        piece = board[src]
+        captured = board[dst]
+        self.undo_stack.append((move, captured, self.castling_rights, self.en_passant_square,
+                                self.halfmove_clock, self.fullmove_num, self.hash, self.score))
+        hash = self.hash ^ ZOBRIST_PIECES[piece][src] ^ ZOBRIST_PIECES[piece][dst] ^ ZOBRIST_PIECES[captured][dst]
+        score = self.score-PIECE_SQUARE_VALUES[piece][src]+PIECE_SQUARE_VALUES[piece][dst]-PIECE_SQUARE_VALUES[captured][dst]
+        hash ^= ZOBRIST_BLACK_TO_MOVE ^ ZOBRIST_EN_PASSANT[self.en_passant_square] ^ ZOBRIST_CASTLING[self.castling_rights]
+        board[dst] = piece
+        board[src] = 0
+        self.en_passant_square = 0
+        if captured or piece == WHITE_PAWN or piece == BLACK_PAWN:
             self.halfmove_clock = 0
-            if move[0:2] == self.en_passant_oppertunity:
-                self.board[dst_col][3] = '0'
-            if src_row == 1 and dst_row == 3:
-                self.en_passant_oppertunity = self.index_to_name(src_col, 2)
-            if dst_row == 7:
-                if move[4] == 'q':
-                    self.board[dst_col][dst_row] = WHITE_QUEEN
-                if move[4] == 'r':
-                    self.board[dst_col][dst_row] = WHITE_ROOK
-                if move[4] == 'b':
-                    self.board[dst_col][dst_row] = WHITE_BISHOP
-                if move[4] == 'n':
-                    self.board[dst_col][dst_row] = WHITE_KNIGHT
-        if moved_piece == BLACK_PAWN:
-            self.halfmove_clock = 0
-            if move[0:2] == self.en_passant_oppertunity:
-                self.board[dst_col][4] = '0'
-            if src_row == 6 and dst_row == 4:
-                self.en_passant_oppertunity = self.index_to_name(src_col, 5)
-            if dst_row == 0:
-                if move[4] == 'q':
-                    self.board[dst_col][dst_row] = BLACK_QUEEN
-                if move[4] == 'r':
-                    self.board[dst_col][dst_row] = BLACK_ROOK
-                if move[4] == 'b':
-                    self.board[dst_col][dst_row] = BLACK_BISHOP
-                if move[4] == 'n':
-                    self.board[dst_col][dst_row] = BLACK_KNIGHT
-        if moved_piece == WHITE_KING:
-            if move == "e1g1" and self.white_castle_kingside:
-                self.execute_move("h1f1")
-            if move == "e1c1" and self.white_castle_queenside:
-                self.execute_move("a1d1")
-            self.white_castle_kingside  = False
-            self.white_castle_queenside = False
-        if moved_piece == BLACK_KING:
-            if move == "e8g8" and self.black_castle_kingside:
-                self.execute_move("h8f8")
-            if move == "e8c8" and self.black_castle_queenside:
-                self.execute_move("a8d8")
-            self.black_castle_kingside  = False
-            self.black_castle_queenside = False
-        if moved_piece == WHITE_ROOK:
-            if move[0:2] == "h1":
-                self.white_castle_kingside = False
-            if move[0:2] == "a1":
-                self.white_castle_queenside = False
-        if moved_piece == BLACK_ROOK:
-            if move[0:2] == "h8":
-                self.black_castle_kingside = False
-            if move[0:2] == "a8":
-                self.black_castle_queenside = False
-        current_state = ' '.join(self.to_fen().split()[:4])
-        self.past_states[current_state] = self.past_states.get(current_state,0) +1
-        
-
-    def next_moves(self):
-        moves=[]
-        for x in range(0,8):
-            for y in range(0,8):
-                if self.is_black_piece(x, y) and self.is_whites_turn:
-                    continue
-                if self.is_white_piece(x, y) and not self.is_whites_turn:
-                    continue
-                piece=self.board[x][y]
-                if piece == WHITE_PAWN:
-                    if y == 1:
-                        if self.board[x][y+2] == 0:
-                            moves.append(self.index_to_name(x, y)+self.index_to_name(x, y+2))
-                    if self.board[x][y+1] == 0:
-                        if y+1 != 7:
-                            moves.append(self.index_to_name(x, y)+self.index_to_name(x, y+1))
+        else:
+            self.halfmove_clock += 1
+        flags = move & MOVE_FLAGS
+        if flags:
+            if flags == MOVE_EN_PASSANT:
+                captured_square = dst-10 if self.is_whites_turn else dst+10
+                hash ^= ZOBRIST_PIECES[board[captured_square]][captured_square]
+                score -= PIECE_SQUARE_VALUES[board[captured_square]][captured_square]
+                board[captured_square] = 0
+            elif flags == MOVE_DOUBLE_PUSH:
+                self.en_passant_square = (src+dst)//2
+                hash ^= ZOBRIST_EN_PASSANT[self.en_passant_square]
+            else:
+                rook_src, rook_dst = (dst+1, dst-1) if dst > src else (dst-2, dst+1)
+                rook = board[rook_src]
+                hash ^= ZOBRIST_PIECES[rook][rook_src] ^ ZOBRIST_PIECES[rook][rook_dst]
+                score += PIECE_SQUARE_VALUES[rook][rook_dst]-PIECE_SQUARE_VALUES[rook][rook_src]
+                board[rook_dst] = rook
+                board[rook_src] = 0
+        promotion = move >> 14 & 15
+        if promotion:
+            hash ^= ZOBRIST_PIECES[piece][dst] ^ ZOBRIST_PIECES[promotion][dst]
+            score += PIECE_SQUARE_VALUES[promotion][dst]-PIECE_SQUARE_VALUES[piece][dst]
+            board[dst] = promotion
+        self.castling_rights &= CASTLING_MASK[src] & CASTLING_MASK[dst]
+        hash ^= ZOBRIST_CASTLING[self.castling_rights]
+        if not self.is_whites_turn:
+            self.fullmove_num += 1
+        self.is_whites_turn = not self.is_whites_turn
+        self.hash = hash
+        self.score = score
+        self.past_states[hash] = self.past_states.get(hash,0) +1
+
+    def unmake_move(self):
+        if self.past_states[self.hash] == 1:
+            del self.past_states[self.hash]
+        else:
+            self.past_states[self.hash] -= 1
+        (move, captured, self.castling_rights, self.en_passant_square,
+         self.halfmove_clock, self.fullmove_num, self.hash, self.score) = self.undo_stack.pop()
+        self.is_whites_turn = not self.is_whites_turn
+        board = self.board
+        src = move & 127
+        dst = move >> 7 & 127
+        if move >> 14 & 15:
+            board[src] = WHITE_PAWN if self.is_whites_turn else BLACK_PAWN
+        else:
+            board[src] = board[dst]
+        board[dst] = captured
+        flags = move & MOVE_FLAGS
+        if flags == MOVE_EN_PASSANT:
+            if self.is_whites_turn:
+                board[dst-10] = BLACK_PAWN
+            else:
+                board[dst+10] = WHITE_PAWN
+        elif flags == MOVE_CASTLE:
+            if dst > src:
+                board[dst+1] = board[dst-1]
+                board[dst-1] = 0
+            else:
+                board[dst-2] = board[dst+1]
+                board[dst+1] = 0
+
+    def generate_moves(self, castling=True):
+        board = self.board
+        moves = []
+        append = moves.append
+        if self.is_whites_turn:
+            own, enemy = IS_WHITE, IS_BLACK
+            pawn, knight, bishop, rook, king = WHITE_PAWN, WHITE_KNIGHT, WHITE_BISHOP, WHITE_ROOK, WHITE_KING
+            forward, start_rank, last_rank, promotions = 10, 1, 7, WHITE_PROMOTIONS
+        else:
+            own, enemy = IS_BLACK, IS_WHITE
+            pawn, knight, bishop, rook, king = BLACK_PAWN, BLACK_KNIGHT, BLACK_BISHOP, BLACK_ROOK, BLACK_KING
+            forward, start_rank, last_rank, promotions = -10, 6, 0, BLACK_PROMOTIONS
+        for src in SQUARES:
+            piece = board[src]
+            if not own[piece]:
+                continue
+            if piece == pawn:
+                dst = src+forward
+                promoting = (dst-21)//10 == last_rank
+                if board[dst] == 0:
+                    if promoting:
+                        for promotion in promotions:
+                            append(src | dst << 7 | promotion << 14)
+                    else:
+                        append(src | dst << 7)
+                        if (src-21)//10 == start_rank and board[dst+forward] == 0:
+                            append(src | (dst+forward) << 7 | MOVE_DOUBLE_PUSH)
+                for dst in (src+forward-1, src+forward+1):
+                    if enemy[board[dst]]:
+                        if promoting:
+                            for promotion in promotions:
+                                append(src | dst << 7 | promotion << 14)
                         else:
-                            for c in "qrbn":
-                                moves.append(self.index_to_name(x, y)+self.index_to_name(x, y+1)+c)
-                    if x < 7:
-                        if self.is_black_piece(x+1, y+1):
-                            if y+1 != 7:
-                                moves.append(self.index_to_name(x, y)+self.index_to_name(x+1, y+1))
-                            else:
-                                for c in "qrbn":
-                                    moves.append(self.index_to_name(x, y)+self.index_to_name(x+1, y+1)+c)
-                        elif self.index_to_name(x+1, y+1) == self.en_passant_oppertunity:
-                            moves.append(self.index_to_name(x, y)+self.index_to_name(x+1, y+1))
-                    if x > 0:
-                        if self.is_black_piece(x-1, y+1):
-                            if y+1 != 7:
-                                moves.append(self.index_to_name(x, y)+self.index_to_name(x-1, y+1))
-                            else:
-                                for c in "qrbn":
-                                    moves.append(self.index_to_name(x, y)+self.index_to_name(x-1, y+1)+c)
-                        elif self.index_to_name(x-1, y+1) == self.en_passant_oppertunity:
-                            moves.append(self.index_to_name(x, y)+self.index_to_name(x-1, y+1))
-                if piece == BLACK_PAWN:
-                    if y == 6:
-                        if self.board[x][y-2] == 0:
-                            moves.append(self.index_to_name(x, y)+self.index_to_name(x, y-2))
-                    if self.board[x][y-1] == 0:
-                        if y-1 != 0:
-                            moves.append(self.index_to_name(x, y)+self.index_to_name(x, y-1))
+                            append(src | dst << 7)
+                    elif dst == self.en_passant_square:
+                        append(src | dst << 7 | MOVE_EN_PASSANT)
+            elif piece == knight or piece == king:
+                for offset in (KNIGHT_OFFSETS if piece == knight else KING_OFFSETS):
+                    dst = src+offset
+                    target = board[dst]
+                    if target == 0 or enemy[target]:
+                        append(src | dst << 7)
+            else:
+                offsets = ROOK_OFFSETS if piece == rook else BISHOP_OFFSETS if piece == bishop else QUEEN_OFFSETS
+                for offset in offsets:
+                    dst = src+offset
+                    while True:
+                        target = board[dst]
+                        if target == 0:
+                            append(src | dst << 7)
                         else:
-                            for c in "qrbn":
-                                moves.append(self.index_to_name(x, y)+self.index_to_name(x, y-1)+c)
-                    if x < 7:
-                        if self.is_white_piece(x+1, y-1):
-                            if y-1 != 0:
-                                moves.append(self.index_to_name(x, y)+self.index_to_name(x+1, y-1))
-                            else:
-                                for c in "qrbn":
-                                    moves.append(self.index_to_name(x, y)+self.index_to_name(x+1, y-1)+c)
-                        elif self.index_to_name(x+1, y-1) == self.en_passant_oppertunity:
-                            moves.append(self.index_to_name(x, y)+self.index_to_name(x+1, y-1))
-                    if x > 0:
-                        if self.is_white_piece(x-1, y-1):
-                            if y-1 != 0:
-                                moves.append(self.index_to_name(x, y)+self.index_to_name(x-1, y-1))
-                            else:
-                                for c in "qrbn":
-                                    moves.append(self.index_to_name(x, y)+self.index_to_name(x-1, y-1)+c)
-                        elif self.index_to_name(x-1, y-1) == self.en_passant_oppertunity:
-                            moves.append(self.index_to_name(x, y)+self.index_to_name(x-1, y-1))
-                if piece == WHITE_KNIGHT:
-                    for dx, dy in KNIGHT_MOVES:
-                        if self.is_on_board(x+dx, y+dy):
-                            if not self.is_white_piece(x+dx, y+dy):
-                                moves.append(self.index_to_name(x, y)+self.index_to_name(x+dx, y+dy))
-                if piece == BLACK_KNIGHT:
-                    for dx, dy in KNIGHT_MOVES:
-                        if self.is_on_board(x+dx, y+dy):
-                            if not self.is_black_piece(x+dx, y+dy):
-                                moves.append(self.index_to_name(x, y)+self.index_to_name(x+dx, y+dy))
-                if piece == WHITE_KING:
-                    for dx, dy in KING_MOVES:
-                        if self.is_on_board(x+dx, y+dy):
-                            if not self.is_white_piece(x+dx, y+dy):
-                                moves.append(self.index_to_name(x, y)+self.index_to_name(x+dx, y+dy))
-                    if self.white_castle_kingside:
-                        if self.is_empty(x+1, y) and self.is_empty(x+2, y):
-                            if self.is_move_legal(self.index_to_name(x, y)+self.index_to_name(x+1, y)):
-                                if self.is_move_legal(self.index_to_name(x, y)+self.index_to_name(x+2, y)):
-                                    moves.append("e1g1")
-                    if self.white_castle_queenside:
-                        if self.is_empty(x-1, y) and self.is_empty(x-2, y):
-                            if self.is_move_legal(self.index_to_name(x, y)+self.index_to_name(x-1, y)):
-                                if self.is_move_legal(self.index_to_name(x, y)+self.index_to_name(x-2, y)):
-                                    moves.append("e1c1")
-                if piece == BLACK_KING:
-                    for dx, dy in KING_MOVES:
-                        if self.is_on_board(x+dx, y+dy):
-                            if not self.is_black_piece(x+dx, y+dy):
-                                moves.append(self.index_to_name(x, y)+self.index_to_name(x+dx, y+dy))
-                    if self.black_castle_kingside:
-                        if self.is_empty(x+1, y) and self.is_empty(x+2, y):
-                            if self.is_move_legal(self.index_to_name(x, y)+self.index_to_name(x+1, y)):
-                                if self.is_move_legal(self.index_to_name(x, y)+self.index_to_name(x+2, y)):
-                                    moves.append("e8g8")
-                    if self.black_castle_queenside:
-                        if self.is_empty(x-1, y) and self.is_empty(x-2, y):
-                            if self.is_move_legal(self.index_to_name(x, y)+self.index_to_name(x-1, y)):
-                                if self.is_move_legal(self.index_to_name(x, y)+self.index_to_name(x-2, y)):
-                                    moves.append("e8c8")
-                if piece == WHITE_BISHOP or piece == WHITE_QUEEN:
-                    for direction in BISHOP_DIRECTIONS:
-                        dx=0
-                        dy=0
-                        while True:
-                            dx=dx+direction[0]
-                            dy=dy+direction[1]
-                            if not self.is_on_board(x+dx, y+dy):
-                                break;
-                            if self.is_white_piece(x+dx, y+dy):
-                                break;
-                            moves.append(self.index_to_name(x, y)+self.index_to_name(x+dx, y+dy))
-                            if self.is_black_piece(x+dx, y+dy):
-                                break;
-                if piece == BLACK_BISHOP or piece == BLACK_QUEEN:
-                    for direction in BISHOP_DIRECTIONS:
-                        dx=0
-                        dy=0
-                        while True:
-                            dx=dx+direction[0]
-                            dy=dy+direction[1]
-                            if not self.is_on_board(x+dx, y+dy):
-                                break;
-                            if self.is_black_piece(x+dx, y+dy):
-                                break;
-                            moves.append(self.index_to_name(x, y)+self.index_to_name(x+dx, y+dy))
-                            if self.is_white_piece(x+dx, y+dy):
-                                break;
-                if piece == WHITE_ROOK or piece == WHITE_QUEEN:
-                    for direction in [[-1, 0], [+1, 0], [0, -1], [0, +1]]:
-                        dx=0
-                        dy=0
-                        while True:
-                            dx=dx+direction[0]
-                            dy=dy+direction[1]
-                            if not self.is_on_board(x+dx, y+dy):
-                                break;
-                            if self.is_white_piece(x+dx, y+dy):
-                                break;
-                            moves.append(self.index_to_name(x, y)+self.index_to_name(x+dx, y+dy))
-                            if self.is_black_piece(x+dx, y+dy):
-                                break;
-                if piece == BLACK_ROOK or piece == BLACK_QUEEN:
-                    for direction in [[-1, 0], [+1, 0], [0, -1], [0, +1]]:
-                        dx=0
-                        dy=0
-                        while True:
-                            dx=dx+direction[0]
-                            dy=dy+direction[1]
-                            if not self.is_on_board(x+dx, y+dy):
-                                break;
-                            if self.is_black_piece(x+dx, y+dy):
-                                break;
-                            moves.append(self.index_to_name(x, y)+self.index_to_name(x+dx, y+dy))
-                            if self.is_white_piece(x+dx, y+dy):
-                                break;
+                            if enemy[target]:
+                                append(src | dst << 7)
+                            break
+                        dst += offset
+        if castling:
+            self.add_castling_moves(append)
         return moves
-    
+
+    def add_castling_moves(self, append):
+        board = self.board
+        if self.is_whites_turn:
+            king_square, kingside, queenside = E1, WHITE_KINGSIDE, WHITE_QUEENSIDE
+        else:
+            king_square, kingside, queenside = E8, BLACK_KINGSIDE, BLACK_QUEENSIDE
+        by_white = not self.is_whites_turn
+        if self.castling_rights & (kingside | queenside) and not self.is_square_attacked(king_square, by_white):
+            if self.castling_rights & kingside:
+                if board[king_square+1] == 0 and board[king_square+2] == 0:
+                    if not self.is_square_attacked(king_square+1, by_white) and not self.is_square_attacked(king_square+2, by_white):
+                        append(king_square | (king_square+2) << 7 | MOVE_CASTLE)
+            if self.castling_rights & queenside:
+                if board[king_square-1] == 0 and board[king_square-2] == 0 and board[king_square-3] == 0:
+                    if not self.is_square_attacked(king_square-1, by_white) and not self.is_square_attacked(king_square-2, by_white):
+                        append(king_square | (king_square-2) << 7 | MOVE_CASTLE)
+
+    def next_moves(self, castling=True):
+        return [move_to_uci(move) for move in self.generate_moves(castling)]
+
     def is_move_legal(self, move):
-        next_state=GameState()
-        next_state.white_castle_kingside=self.white_castle_kingside
-        next_state.white_castle_queenside=self.white_castle_queenside
-        next_state.black_castle_kingside=self.black_castle_kingside
-        next_state.black_castle_queenside=self.black_castle_queenside
-        next_state.is_whites_turn=self.is_whites_turn
-        next_state.board=copy_board(self.board)
-        next_state.execute_move(move)
-        return not next_state.is_in_check()
-    
+        self.make_move(move)
+        legal = not self.is_king_attacked(not self.is_whites_turn)
+        self.unmake_move()
+        return legal
+
+    def find_checks_and_pins(self, king_square):
+        # returns the number of checkers, the squares that stop a single check and
+        # for every pinned piece the squares it may still move to
+        board = self.board
+        if self.is_whites_turn:
+            own = IS_WHITE
+            pawn, knight, bishop, rook, queen = BLACK_PAWN, BLACK_KNIGHT, BLACK_BISHOP, BLACK_ROOK, BLACK_QUEEN
+            pawn_offsets = (9, 11)
+        else:
+            own = IS_BLACK
+            pawn, knight, bishop, rook, queen = WHITE_PAWN, WHITE_KNIGHT, WHITE_BISHOP, WHITE_ROOK, WHITE_QUEEN
+            pawn_offsets = (-9, -11)
+        checks = 0
+        check_mask = ()
+        pins = {}
+        for offset in pawn_offsets:
+            if board[king_square+offset] == pawn:
+                checks += 1
+                check_mask = (king_square+offset,)
+        for offset in KNIGHT_OFFSETS:
+            if board[king_square+offset] == knight:
+                checks += 1
+                check_mask = (king_square+offset,)
+        for offsets, slider in ((BISHOP_OFFSETS, bishop), (ROOK_OFFSETS, rook)):
+            for offset in offsets:
+                line = []
+                pinned = 0
+                target = king_square+offset
+                while True:
+                    piece = board[target]
+                    line.append(target)
+                    if piece == 0:
+                        target += offset
+                        continue
+                    if own[piece] and not pinned:
+                        pinned = target
+                        target += offset
+                        continue
+                    if piece == slider or piece == queen:
+                        if pinned:
+                            pins[pinned] = line
+                        else:
+                            checks += 1
+                            check_mask = line
+                    break
+        return checks, check_mask, pins
+
+    def legality_check(self):
+        # finds the checks and pins once and returns a test for single pseudo legal moves,
+        # so moves can be checked one at a time, only when they are needed
+        board = self.board
+        king = WHITE_KING if self.is_whites_turn else BLACK_KING
+        king_square = board.index(king)
+        checks, check_mask, pins = self.find_checks_and_pins(king_square)
+        by_white = not self.is_whites_turn
+        def is_legal(move):
+            src = move & 127
+            dst = move >> 7 & 127
+            if src == king_square:
+                if move & MOVE_CASTLE:
+                    return True
+                board[king_square] = 0
+                legal = not self.is_square_attacked(dst, by_white)
+                board[king_square] = king
+                return legal
+            if checks > 1:
+                return False
+            if move & MOVE_EN_PASSANT:
+                return self.is_move_legal(move)
+            if checks and dst not in check_mask:
+                return False
+            return src not in pins or dst in pins[src]
+        return is_legal, checks
+
+    def generate_legal_moves(self, captures_only=False):
+        is_legal, checks = self.legality_check()
+        moves = self.generate_moves(castling=not checks and not captures_only)
+        if captures_only:
+            board = self.board
+            moves = [move for move in moves if board[move >> 7 & 127] or move & MOVE_TACTICAL]
+        return [move for move in moves if is_legal(move)]
+
+    def is_pseudo_legal(self, move):
+        # checks a move that was not generated here, like one from the transposition table,
+        # against the board, a different position may share its hash
+        board = self.board
+        src = move & 127
+        dst = move >> 7 & 127
+        piece = board[src]
+        target = board[dst]
+        if self.is_whites_turn:
+            own, enemy = IS_WHITE, IS_BLACK
+            pawn, knight, king, forward, start_rank, last_rank = WHITE_PAWN, WHITE_KNIGHT, WHITE_KING, 10, 1, 7
+            promotions = WHITE_PROMOTIONS
+        else:
+            own, enemy = IS_BLACK, IS_WHITE
+            pawn, knight, king, forward, start_rank, last_rank = BLACK_PAWN, BLACK_KNIGHT, BLACK_KING, -10, 6, 0
+            promotions = BLACK_PROMOTIONS
+        if not own[piece] or own[target] or target == OFFBOARD:
+            return False
+        promotion = move >> 14 & 15
+        flags = move & MOVE_FLAGS
+        if piece == pawn:
+            if ((dst-21)//10 == last_rank) != (promotion in promotions):
+                return False
+            if flags == MOVE_DOUBLE_PUSH:
+                return dst == src+2*forward and (src-21)//10 == start_rank and board[src+forward] == 0 and target == 0
+            if flags == MOVE_EN_PASSANT:
+                return dst == self.en_passant_square and dst-src in (forward-1, forward+1)
+            if flags:
+                return False
+            if dst == src+forward:
+                return target == 0
+            return dst-src in (forward-1, forward+1) and enemy[target]
+        if promotion:
+            return False
+        if flags == MOVE_CASTLE:
+            if piece != king:
+                return False
+            castles = []
+            self.add_castling_moves(castles.append)
+            return move in castles
+        if flags:
+            return False
+        if piece == knight:
+            return dst-src in KNIGHT_OFFSETS
+        if piece == king:
+            return dst-src in KING_OFFSETS
+        offsets = ROOK_OFFSETS if piece in (WHITE_ROOK, BLACK_ROOK) else BISHOP_OFFSETS if piece in (WHITE_BISHOP, BLACK_BISHOP) else QUEEN_OFFSETS
+        for offset in offsets:
+            sq = src+offset
+            while board[sq] == 0 and sq != dst:
+                sq += offset
+            if sq == dst:
+                return True
+        return False
+
     def next_legal_moves(self):
-        legal_moves=[]
-        moves=self.next_moves()
+        return [move_to_uci(move) for move in self.generate_legal_moves()]
+
+    def perft(self, depth):
+        if depth == 0:
+            return 1
+        moves = self.generate_legal_moves()
+        if depth == 1:
+            return len(moves)
+        nodes = 0
         for move in moves:
-            if self.is_move_legal(move):
-                legal_moves.append(move)
-        return legal_moves
-        
+            self.make_move(move)
+            nodes += self.perft(depth-1)
+            self.unmake_move()
+        return nodes
+
+    def divide(self, depth):
+        counts = {}
+        for move in self.generate_legal_moves():
+            self.make_move(move)
+            counts[move_to_uci(move)] = self.perft(depth-1)
+            self.unmake_move()
+        return counts
+
     def is_checkmate(self):
-        return len(self.next_legal_moves()) == 0 and self.is_in_check()
+        return len(self.generate_legal_moves()) == 0 and self.is_in_check()
 
     def is_stalemate(self):
-        return len(self.next_legal_moves()) == 0 and not self.is_in_check()
-        
+        return len(self.generate_legal_moves()) == 0 and not self.is_in_check()
+
     def check_threefold_repetition(self):
-        return max(self.past_states.values()) > 2
-        
+        return self.past_states.get(self.hash, 0) > 2
+
+    def is_draw_by_rule(self):
+        # the clock counts plies, fifty moves by each side are a hundred of them
+        return self.halfmove_clock >= 100 or self.check_threefold_repetition()
+
     def is_tie(self):
-        return self.is_stalemate() or (self.halfmove_clock == 50) or self.check_threefold_repetition()
-        
+        return self.is_stalemate() or self.is_draw_by_rule()
+
     def evaluate_position(self):
-        fen = self.to_fen()
-        if fen in eval_table:
-            return eval_table[fen]
-        value = 0
-        for x in range(8):
-            for y in range(8):
-                piece=self.board[x][y]
-                value += 1*(piece == WHITE_PAWN)
-                value += 3*(piece == WHITE_KNIGHT)
-                value += 3*(piece == WHITE_BISHOP)
-                value += 5*(piece == WHITE_ROOK)
-                value += 9*(piece == WHITE_QUEEN)
-                value -= 1*(piece == BLACK_PAWN)
-                value -= 3*(piece == BLACK_KNIGHT)
-                value -= 3*(piece == BLACK_BISHOP)
-                value -= 5*(piece == BLACK_ROOK)
-                value -= 9*(piece == BLACK_QUEEN)
-        if self.is_checkmate():
-            value = -1000 if self.is_whites_turn else 1000
-        if self.is_tie():
-            value = 0
-        eval_table[fen] = value
-        return value
-        
+        if self.is_draw_by_rule():
+            return 0
+        if not self.generate_legal_moves():
+            if self.is_in_check():
+                return -MATE_VALUE if self.is_whites_turn else MATE_VALUE
+            return 0
+        return self.score
+
     def find_best_move(self, depth, alpha=float("-inf"), beta=float("inf")):
-        best_move = ""
+        best_move, best_move_value, _ = self.search(depth=depth, alpha=alpha, beta=beta)
+        return best_move, best_move_value
+
+    def allocate_time(self, movetime=None, wtime=None, btime=None, winc=0, binc=0, movestogo=None):
+        if movetime is not None:
+            return max(1, movetime-MOVE_OVERHEAD_MS)/1000
+        time_left = wtime if self.is_whites_turn else btime
+        if time_left is None:
+            return None
+        increment = (winc if self.is_whites_turn else binc) or 0
+        budget = time_left/(movestogo or DEFAULT_MOVES_TO_GO)+increment*3/4
+        budget = min(budget, time_left/2)-MOVE_OVERHEAD_MS
+        return max(1, budget)/1000
+
+    def search(self, depth=None, movetime=None, wtime=None, btime=None, winc=0, binc=0, movestogo=None, nodes=None,
+               alpha=float("-inf"), beta=float("inf"), searchmoves=None, on_iteration=None):
+        # iterative deepening until the depth, time or node budget runs out, the move of the
+        # last completed iteration is returned together with its value and depth
+        budget = self.allocate_time(movetime, wtime, btime, winc, binc, movestogo)
+        start = time.monotonic()
+        self.deadline = start+budget if budget is not None else None
+        self.node_limit = nodes
+        self.nodes = 0
+        self.stop_search = False
+        stats = self.stats
+        if stats is not None:
+            stats.reset()
+        if self.book is not None:
+            book_move = self.book.choose_move(self, searchmoves)
+            if book_move:
+                return book_move, self.score, 0
+        if self.tablebases is not None and not searchmoves:
+            result = self.tablebases.best_move(self)
+            if result is not None:
+                return result[0], result[1], 0
+        self.root_moves = None
+        if searchmoves:
+            self.root_moves = [self.parse_move(move) if type(move) is str else move for move in searchmoves]
+        self.killers = [[0, 0] for _ in range(MAX_PLY)]
+        for piece_history in self.history:
+            for sq in SQUARES:
+                piece_history[sq] >>= 3
+        self.transposition_table.new_search()
+        undo_depth = len(self.undo_stack)
+        best_move, best_move_value, completed_depth = 0, 0, 0
+        if stats is not None:
+            self.instrument(stats)
+        try:
+            for current_depth in range(1, min(depth or MAX_PLY, MAX_PLY)+1):
+                self.search_depth = current_depth
+                try:
+                    move, value = self.alpha_beta(current_depth, alpha, beta)
+                except SearchTimeout:
+                    while len(self.undo_stack) > undo_depth:
+                        self.unmake_move()
+                    break
+                best_move, best_move_value, completed_depth = move, value, current_depth
+                if on_iteration is not None:
+                    iteration = {"depth": current_depth, "move": move_to_uci(move) if move else "", "score": value,
+                                 "nodes": self.nodes, "time": time.monotonic()-start}
+                    if stats is not None:
+                        iteration["stats"] = stats.end_iteration(current_depth, self.nodes, iteration["time"])
+                    on_iteration(iteration)
+                elif stats is not None:
+                    stats.end_iteration(current_depth, self.nodes, time.monotonic()-start)
+                if not move or self.stop_search or abs(value) >= MATE_THRESHOLD:
+                    break
+                if self.node_limit is not None and self.nodes >= self.node_limit:
+                    break
+                # an iteration takes several times as long as the previous one
+                if self.deadline is not None and time.monotonic()-start > budget/2:
+                    break
+        finally:
+            if stats is not None:
+                self.uninstrument()
+                stats.nodes = self.nodes
+                stats.time = time.monotonic()-start
+        return (move_to_uci(best_move) if best_move else ""), best_move_value, completed_depth
+
+    def instrument(self, stats):
+        # shadows the hot methods with counting and timing versions for one search, so that
+        # a search without stats runs the plain methods and pays nothing for them
+        clock = time.perf_counter
+        generate_moves = self.generate_moves
+        legality_check = self.legality_check
+        make_move = self.make_move
+        unmake_move = self.unmake_move
+        quiescence = self.quiescence
+        table = self.transposition_table
+        probe = table.probe
+
+        def timed_generate_moves(castling=True):
+            start = clock()
+            moves = generate_moves(castling)
+            stats.movegen_time += clock()-start
+            return moves
+
+        def timed_legality_check():
+            start = clock()
+            is_legal, checks = legality_check()
+            stats.legality_time += clock()-start
+            def timed_is_legal(move):
+                start = clock()
+                legal = is_legal(move)
+                stats.legality_time += clock()-start
+                return legal
+            return timed_is_legal, checks
+
+        def timed_make_move(move):
+            start = clock()
+            make_move(move)
+            stats.make_unmake_time += clock()-start
+
+        def timed_unmake_move():
+            start = clock()
+            unmake_move()
+            stats.make_unmake_time += clock()-start
+
+        def counted_quiescence(alpha, beta, ply):
+            stats.qnodes += 1
+            return quiescence(alpha, beta, ply)
+
+        def counted_probe(hash):
+            stats.tt_probes += 1
+            entry = probe(hash)
+            if entry is not None:
+                stats.tt_hits += 1
+            elif table.entries[hash % table.size] is not None:
+                stats.tt_collisions += 1
+            return entry
+
+        self.generate_moves = timed_generate_moves
+        self.legality_check = timed_legality_check
+        self.make_move = timed_make_move
+        self.unmake_move = timed_unmake_move
+        self.quiescence = counted_quiescence
+        table.probe = counted_probe
+
+    def uninstrument(self):
+        for name in ("generate_moves", "legality_check", "make_move", "unmake_move", "quiescence"):
+            self.__dict__.pop(name, None)
+        self.transposition_table.__dict__.pop("probe", None)
+
+    def principal_variation(self, move, max_length=MAX_PLY):
+        # follows the hash moves from the root, until one is missing, illegal or repeats a position
+        if type(move) is str:
+            move = self.parse_move(move) if move else 0
+        variation = []
+        seen = set()
+        while move and len(variation) < max_length and self.hash not in seen and move in self.generate_legal_moves():
+            seen.add(self.hash)
+            variation.append(move_to_uci(move))
+            self.make_move(move)
+            entry = self.transposition_table.probe(self.hash)
+            move = entry[4] if entry is not None else 0
+        for _ in variation:
+            self.unmake_move()
+        return variation
+
+    def check_limits(self):
+        if self.search_depth == 1:
+            return
+        if self.stop_search or (self.stop_event is not None and self.stop_event.is_set()):
+            raise SearchTimeout()
+        if self.node_limit is not None and self.nodes >= self.node_limit:
+            raise SearchTimeout()
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            raise SearchTimeout()
+
+    def staged_moves(self, hash_move=0, ply=0, captures_only=False):
+        # yields the legal moves lazily: the hash move before anything is generated, then the captures,
+        # most valuable victim first and least valuable attacker among those, the killers and the other
+        # quiet moves by history, only the moves handed out are checked for legality
+        is_legal, checks = self.legality_check()
+        if hash_move and self.is_pseudo_legal(hash_move) and is_legal(hash_move):
+            yield hash_move
+        board = self.board
+        captures = []
+        quiets = []
+        for move in self.generate_moves(castling=not checks and not captures_only):
+            if board[move >> 7 & 127] or move & MOVE_TACTICAL:
+                captures.append(move)
+            elif not captures_only:
+                quiets.append(move)
+        captures.sort(key=lambda move: ORDERING_VALUES[board[move >> 7 & 127]]*16-ORDERING_VALUES[board[move & 127]]
+                      +ORDERING_VALUES[move >> 14 & 15]*16, reverse=True)
+        for move in captures:
+            if move != hash_move and is_legal(move):
+                yield move
+        if captures_only:
+            return
+        killers = self.killers[ply]
+        for killer in killers:
+            if killer and killer != hash_move and killer in quiets and is_legal(killer):
+                yield killer
+        history = self.history
+        quiets.sort(key=lambda move: history[board[move & 127]][move >> 7 & 127], reverse=True)
+        for move in quiets:
+            if move != hash_move and move != killers[0] and move != killers[1] and is_legal(move):
+                yield move
+
+    def record_cutoff(self, move, depth, ply):
+        if self.board[move >> 7 & 127] or move >> 14:
+            return
+        killers = self.killers[ply]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+        piece_history = self.history[self.board[move & 127]]
+        piece_history[move >> 7 & 127] = min(piece_history[move >> 7 & 127]+depth*depth, 1 << 22)
+
+    def alpha_beta(self, depth, alpha, beta, ply=0):
+        # a horizon node is counted by quiescence, counting it here too would count it twice
+        if depth == 0:
+            return 0, self.quiescence(alpha, beta, ply)
+        self.nodes += 1
+        if self.nodes & 1023 == 0:
+            self.check_limits()
+        if self.tablebases is not None and ply:
+            value = self.tablebases.probe_score(self, ply)
+            if value is not None:
+                return 0, value
+        table = self.transposition_table
+        entry = table.probe(self.hash)
+        hash_move = 0
+        if entry is not None:
+            hash_move = entry[4]
+            if entry[1] >= depth and ply:
+                score, bound = score_from_table(entry[2], ply), entry[3]
+                if bound == EXACT:
+                    return hash_move, score
+                if bound == LOWER_BOUND:
+                    alpha = max(alpha, score)
+                else:
+                    beta = min(beta, score)
+                if beta <= alpha:
+                    return hash_move, score
+        moves = self.staged_moves(hash_move, ply)
+        if not ply and self.root_moves:
+            moves = list(moves)
+            moves = [move for move in moves if move in self.root_moves] or moves
+        original_alpha, original_beta = alpha, beta
+        best_move = 0
         best_move_value = float("-inf") if self.is_whites_turn else float("inf")
-        next_state=GameState()
-        next_state.white_castle_kingside=self.white_castle_kingside
-        next_state.white_castle_queenside=self.white_castle_queenside
-        next_state.black_castle_kingside=self.black_castle_kingside
-        next_state.black_castle_queenside=self.black_castle_queenside
-        next_state.is_whites_turn=not self.is_whites_turn
-        next_state.past_states={key:value for key,value  in self.past_states.items()}
-        for move in self.next_legal_moves():
-            next_state.board=copy_board(self.board)
-            next_state.execute_move(move)
-            if depth == 1:
-                next_evaluation = next_state.evaluate_position()
+        searched = 0
+        for move in moves:
+            searched += 1
+            self.make_move(move)
+            if self.is_draw_by_rule():
+                next_evaluation = 0
             else:
-                _, next_evaluation = next_state.find_best_move(depth-1, alpha, beta)
+                _, next_evaluation = self.alpha_beta(depth-1, alpha, beta, ply+1)
+            self.unmake_move()
             if self.is_whites_turn:
                 if next_evaluation > best_move_value:
                     best_move_value = next_evaluation
@@ -459,9 +1260,292 @@ class GameState:
                     best_move = move
                     beta = min(beta, best_move_value)
             if beta <= alpha:
+                self.record_cutoff(move, depth, ply)
+                if self.stats is not None:
+                    self.stats.cutoffs += 1
+                    self.stats.first_move_cutoffs += searched == 1
                 break
+        if not searched:
+            value = self.mated_value(ply) if self.is_in_check() else 0
+            table.store(self.hash, depth, score_to_table(value, ply), EXACT, 0)
+            return 0, value
+        if best_move_value <= original_alpha:
+            bound = UPPER_BOUND
+        elif best_move_value >= original_beta:
+            bound = LOWER_BOUND
+        else:
+            bound = EXACT
+        if ply or not self.root_moves:
+            table.store(self.hash, depth, score_to_table(best_move_value, ply), bound, best_move)
         return best_move, best_move_value
-        
+
+    def mated_value(self, ply):
+        # mates further away from the root score a little less, so the shortest one is played
+        return -MATE_VALUE+ply if self.is_whites_turn else MATE_VALUE-ply
+
+    def quiescence(self, alpha, beta, ply):
+        # only captures and promotions are searched below the horizon, unless the side to move is in check
+        self.nodes += 1
+        if self.nodes & 1023 == 0:
+            self.check_limits()
+        in_check = self.is_in_check()
+        if in_check:
+            best_value = float("-inf") if self.is_whites_turn else float("inf")
+        else:
+            best_value = self.score
+            if self.is_whites_turn:
+                if best_value >= beta:
+                    return best_value
+                alpha = max(alpha, best_value)
+            else:
+                if best_value <= alpha:
+                    return best_value
+                beta = min(beta, best_value)
+        if ply >= MAX_PLY-1:
+            return self.score
+        searched = 0
+        for move in self.staged_moves(0, ply, captures_only=not in_check):
+            searched += 1
+            self.make_move(move)
+            value = self.quiescence(alpha, beta, ply+1)
+            self.unmake_move()
+            if self.is_whites_turn:
+                if value > best_value:
+                    best_value = value
+                    alpha = max(alpha, value)
+            else:
+                if value < best_value:
+                    best_value = value
+                    beta = min(beta, value)
+            if beta <= alpha:
+                break
+        if in_check and not searched:
+            return self.mated_value(ply)
+        return best_value
+
+class BitboardGameState(GameState):
+    # keeps one 64-bit bitboard per piece next to the mailbox board and generates
+    # moves from precomputed attack tables instead of walking the mailbox
+
+    def __init__(self, hash_size_mb=DEFAULT_HASH_MB, backend=None):
+        GameState.__init__(self, hash_size_mb)
+        self.compute_bitboards()
+
+    def compute_bitboards(self):
+        self.bitboards = [0]*13
+        for i, sq in enumerate(SQUARES):
+            if self.board[sq]:
+                self.bitboards[self.board[sq]] |= 1 << i
+
+    def reset_history(self):
+        GameState.reset_history(self)
+        self.compute_bitboards()
+
+    def toggle_move_bits(self, move, captured, white):
+        bitboards = self.bitboards
+        src = SQ64[move & 127]
+        dst = SQ64[move >> 7 & 127]
+        promotion = move >> 14 & 15
+        if promotion:
+            bitboards[WHITE_PAWN if white else BLACK_PAWN] ^= 1 << src
+            bitboards[promotion] ^= 1 << dst
+        else:
+            bitboards[self.board[move >> 7 & 127]] ^= 1 << src | 1 << dst
+        if captured:
+            bitboards[captured] ^= 1 << dst
+        flags = move & MOVE_FLAGS
+        if flags == MOVE_EN_PASSANT:
+            if white:
+                bitboards[BLACK_PAWN] ^= 1 << (dst-8)
+            else:
+                bitboards[WHITE_PAWN] ^= 1 << (dst+8)
+        elif flags == MOVE_CASTLE:
+            rook = WHITE_ROOK if white else BLACK_ROOK
+            if dst > src:
+                bitboards[rook] ^= 1 << (dst+1) | 1 << (dst-1)
+            else:
+                bitboards[rook] ^= 1 << (dst-2) | 1 << (dst+1)
+
+    def make_move(self, move):
+        if type(move) is str:
+            move = self.parse_move(move)
+        board = self.board
+        src = move & 127
+        dst = move >> 7 & 127
+        piece = board[src]
+        captured = board[dst]
+        GameState.make_move(self, move)
+        if move >> 14:
+            self.toggle_move_bits(move, captured, not self.is_whites_turn)
+        else:
+            bitboards = self.bitboards
+            bitboards[piece] ^= BITS[src] | BITS[dst]
+            if captured:
+                bitboards[captured] ^= BITS[dst]
+
+    def unmake_move(self):
+        move, captured = self.undo_stack[-1][:2]
+        if move >> 14:
+            self.toggle_move_bits(move, captured, not self.is_whites_turn)
+        else:
+            bitboards = self.bitboards
+            dst = move >> 7 & 127
+            bitboards[self.board[dst]] ^= BITS[move & 127] | BITS[dst]
+            if captured:
+                bitboards[captured] ^= BITS[dst]
+        GameState.unmake_move(self)
+
+    def occupancy(self):
+        bitboards = self.bitboards
+        white = bitboards[1] | bitboards[2] | bitboards[3] | bitboards[4] | bitboards[5] | bitboards[6]
+        black = bitboards[7] | bitboards[8] | bitboards[9] | bitboards[10] | bitboards[11] | bitboards[12]
+        return white, black
+
+    def attackers(self, sq, by_white, occupied):
+        bitboards = self.bitboards
+        if by_white:
+            pawn, knight, bishop, rook, queen, king = WHITE_PAWN, WHITE_KNIGHT, WHITE_BISHOP, WHITE_ROOK, WHITE_QUEEN, WHITE_KING
+            pawn_attacks = BLACK_PAWN_ATTACKS
+        else:
+            pawn, knight, bishop, rook, queen, king = BLACK_PAWN, BLACK_KNIGHT, BLACK_BISHOP, BLACK_ROOK, BLACK_QUEEN, BLACK_KING
+            pawn_attacks = WHITE_PAWN_ATTACKS
+        attackers = pawn_attacks[sq] & bitboards[pawn]
+        attackers |= KNIGHT_ATTACKS[sq] & bitboards[knight]
+        attackers |= KING_ATTACKS[sq] & bitboards[king]
+        queens = bitboards[queen]
+        if BISHOP_LINES[sq] & (bitboards[bishop] | queens):
+            attackers |= bishop_attacks(sq, occupied) & (bitboards[bishop] | queens)
+        if ROOK_LINES[sq] & (bitboards[rook] | queens):
+            attackers |= rook_attacks(sq, occupied) & (bitboards[rook] | queens)
+        return attackers
+
+    def is_square_attacked(self, sq, by_white):
+        white, black = self.occupancy()
+        return self.attackers(SQ64[sq], by_white, white | black) != 0
+
+    def generate_moves(self, castling=True):
+        bitboards = self.bitboards
+        moves = []
+        append = moves.append
+        white, black = self.occupancy()
+        occupied = white | black
+        empty = ~occupied & BITBOARD_FULL
+        if self.is_whites_turn:
+            own, enemy = white, black
+            pawn, knight, bishop, rook, queen, king = WHITE_PAWN, WHITE_KNIGHT, WHITE_BISHOP, WHITE_ROOK, WHITE_QUEEN, WHITE_KING
+            promotions = WHITE_PROMOTIONS
+            pawns = bitboards[pawn]
+            single = pawns << 8 & empty
+            pawn_targets = ((single, 8, 0), ((single & RANK_3) << 8 & empty, 16, MOVE_DOUBLE_PUSH),
+                            ((pawns & ~FILE_A) << 7 & enemy, 7, 0), ((pawns & ~FILE_H) << 9 & enemy, 9, 0))
+            en_passant_attackers = BLACK_PAWN_ATTACKS
+        else:
+            own, enemy = black, white
+            pawn, knight, bishop, rook, queen, king = BLACK_PAWN, BLACK_KNIGHT, BLACK_BISHOP, BLACK_ROOK, BLACK_QUEEN, BLACK_KING
+            promotions = BLACK_PROMOTIONS
+            pawns = bitboards[pawn]
+            single = pawns >> 8 & empty
+            pawn_targets = ((single, -8, 0), ((single & RANK_6) >> 8 & empty, -16, MOVE_DOUBLE_PUSH),
+                            ((pawns & ~FILE_A) >> 9 & enemy, -9, 0), ((pawns & ~FILE_H) >> 7 & enemy, -7, 0))
+            en_passant_attackers = WHITE_PAWN_ATTACKS
+        not_own = ~own & BITBOARD_FULL
+        for targets, delta, flags in pawn_targets:
+            while targets:
+                bit = targets & -targets
+                targets ^= bit
+                dst = bit.bit_length()-1
+                src = SQ120[dst-delta] | SQ120[dst] << 7
+                if bit & PROMOTION_RANKS:
+                    for promotion in promotions:
+                        append(src | promotion << 14)
+                else:
+                    append(src | flags)
+        if self.en_passant_square:
+            dst = SQ64[self.en_passant_square]
+            sources = en_passant_attackers[dst] & pawns
+            while sources:
+                bit = sources & -sources
+                sources ^= bit
+                append(SQ120[bit.bit_length()-1] | self.en_passant_square << 7 | MOVE_EN_PASSANT)
+        for piece in (knight, bishop, rook, queen, king):
+            pieces = bitboards[piece]
+            while pieces:
+                bit = pieces & -pieces
+                pieces ^= bit
+                sq = bit.bit_length()-1
+                if piece == knight:
+                    targets = KNIGHT_ATTACKS[sq] & not_own
+                elif piece == king:
+                    targets = KING_ATTACKS[sq] & not_own
+                elif piece == bishop:
+                    targets = bishop_attacks(sq, occupied) & not_own
+                elif piece == rook:
+                    targets = rook_attacks(sq, occupied) & not_own
+                else:
+                    targets = (bishop_attacks(sq, occupied) | rook_attacks(sq, occupied)) & not_own
+                src = SQ120[sq]
+                while targets:
+                    bit = targets & -targets
+                    targets ^= bit
+                    append(src | SQ120[bit.bit_length()-1] << 7)
+        if castling:
+            self.add_castling_moves(append)
+        return moves
+
+    def legality_check(self):
+        bitboards = self.bitboards
+        white, black = self.occupancy()
+        occupied = white | black
+        if self.is_whites_turn:
+            own = white
+            king, enemy_bishop, enemy_rook, enemy_queen = WHITE_KING, BLACK_BISHOP, BLACK_ROOK, BLACK_QUEEN
+        else:
+            own = black
+            king, enemy_bishop, enemy_rook, enemy_queen = BLACK_KING, WHITE_BISHOP, WHITE_ROOK, WHITE_QUEEN
+        by_white = not self.is_whites_turn
+        king_sq = bitboards[king].bit_length()-1
+        checkers = self.attackers(king_sq, by_white, occupied)
+        check_mask = 0
+        if checkers and not checkers & (checkers-1):
+            check_mask = checkers | BETWEEN[king_sq][checkers.bit_length()-1]
+        pins = {}
+        snipers = ROOK_LINES[king_sq] & (bitboards[enemy_rook] | bitboards[enemy_queen])
+        snipers |= BISHOP_LINES[king_sq] & (bitboards[enemy_bishop] | bitboards[enemy_queen])
+        while snipers:
+            bit = snipers & -snipers
+            snipers ^= bit
+            between = BETWEEN[king_sq][bit.bit_length()-1]
+            blockers = between & occupied
+            if blockers and not blockers & (blockers-1) and blockers & own:
+                pins[blockers.bit_length()-1] = between | bit
+        occupied_without_king = occupied ^ (1 << king_sq)
+        def is_legal(move):
+            src = SQ64[move & 127]
+            dst = SQ64[move >> 7 & 127]
+            if src == king_sq:
+                return move & MOVE_CASTLE or not self.attackers(dst, by_white, occupied_without_king)
+            if checkers and not check_mask:
+                return False
+            if move & MOVE_EN_PASSANT:
+                return self.is_move_legal(move)
+            if checkers and not check_mask >> dst & 1:
+                return False
+            return src not in pins or pins[src] >> dst & 1
+        return is_legal, checkers
+
+BACKENDS = {'mailbox': GameState, 'bitboard': BitboardGameState}
+
+def pack_positions(states):
+    return b''.join(state.to_packed() for state in states)
+
+def unpack_positions(buffer, state=None):
+    # decodes a buffer of packed positions lazily, like a memory mapped file, into one reused state
+    state = state or GameState()
+    buffer = memoryview(buffer)
+    for offset in range(0, len(buffer)-PACKED_POSITION.size+1, PACKED_POSITION.size):
+        state.set_packed(buffer, offset)
+        yield state
+
 if __name__=='__main__':
     unicode_pieces=True
     testgame=GameState()
@@ -472,10 +1556,9 @@ if __name__=='__main__':
             if testgame.is_whites_turn:
                 next_move = input()
             else:
-                next_move = testgame.find_best_move(1)[0]
+                next_move = testgame.search(movetime=3000)[0]
                 print(next_move)
-        testgame.execute_move(next_move)
-        testgame.is_whites_turn = not testgame.is_whites_turn
+        testgame.make_move(next_move)
         if testgame.is_tie() or testgame.is_checkmate():
             testgame.pretty_print(unicode_pieces)
             break
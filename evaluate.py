@@ -0,0 +1,128 @@
+import argparse
+import mmap
+import sys
+
+from batch import parse_epd
+from chess import PACKED_POSITION, PIECE_SQUARE_VALUES, SQ120, SQUARES, GameState
+
+try:
+    import numpy
+except ImportError:
+    # numpy is optional, without it every function here falls back to plain python
+    numpy = None
+
+# the material and piece square score of every piece on every square, indexed by the squares 0 (a1) to 63 (h8)
+SQUARE_VALUES = [[PIECE_SQUARE_VALUES[piece][sq] for sq in SQUARES] for piece in range(13)]
+
+# positions evaluated at once, small enough for the intermediate arrays to stay in the cpu caches
+CHUNK_SIZE = 4096
+
+if numpy is not None:
+    # flattened to SQUARE_VALUES[piece][sq] at sq*13+piece, so a board indexes it directly after adding SQUARE_OFFSETS
+    SQUARE_VALUES_ARRAY = numpy.array(SQUARE_VALUES, dtype=numpy.int64).T.ravel().copy()
+    SQUARE_OFFSETS = numpy.arange(64, dtype=numpy.intp)*13
+    PACKED_DTYPE = numpy.dtype([('occupancy', '<u8'), ('flags', 'u1'), ('en_passant', 'u1'), ('halfmove_clock', '<u2'),
+                                ('fullmove_num', '<u2'), ('pieces', 'u1', 16), ('padding', 'u1', 2)])
+    assert PACKED_DTYPE.itemsize == PACKED_POSITION.size
+
+def _require_numpy():
+    if numpy is None:
+        raise ImportError("the board arrays need numpy, evaluate_states and evaluate_packed work without it")
+
+def boards_array(states):
+    # stacks the boards of game states into an (N, 64) array of pieces, a1 first
+    _require_numpy()
+    boards = numpy.zeros((len(states), 64), dtype=numpy.uint8)
+    for i, state in enumerate(states):
+        board = state.board
+        boards[i] = [board[sq] for sq in SQUARES]
+    return boards
+
+def packed_boards_array(buffer):
+    # decodes the boards of a buffer of packed positions (see chess.pack_positions) into an (N, 64)
+    # array without going through a game state
+    _require_numpy()
+    positions = numpy.frombuffer(buffer, dtype=PACKED_DTYPE, count=len(buffer)//PACKED_POSITION.size)
+    return numpy.concatenate([_decode_boards(positions[i:i+CHUNK_SIZE]) for i in range(0, len(positions), CHUNK_SIZE)]
+                             or [numpy.zeros((0, 64), dtype=numpy.uint8)])
+
+def _decode_boards(positions):
+    # the pieces are stored in square order, so the piece on an occupied square is the one numbered by
+    # the occupied squares up to it, empty squares pick the zero put in front of every row
+    count = len(positions)
+    occupied = numpy.unpackbits(positions['occupancy'].astype('<u8').view(numpy.uint8).reshape(-1, 8), axis=1, bitorder='little')
+    pieces = positions['pieces']
+    nibbles = numpy.zeros((count, 33), dtype=numpy.uint8)
+    nibbles[:, 1::2] = pieces & 15
+    nibbles[:, 2::2] = pieces >> 4
+    order = numpy.cumsum(occupied, axis=1, dtype=numpy.intp)
+    order *= occupied
+    order += numpy.arange(0, count*33, 33, dtype=numpy.intp)[:, None]
+    boards = nibbles.ravel()[order]
+    if boards.max(initial=0) > 12 or numpy.count_nonzero(boards) != numpy.count_nonzero(occupied):
+        raise ValueError("invalid packed position")
+    return boards
+
+def evaluate_boards(boards):
+    # the static score, positive for white, of every row of an (N, 64) board array
+    _require_numpy()
+    return SQUARE_VALUES_ARRAY[boards+SQUARE_OFFSETS].sum(axis=1)
+
+def evaluate_states(states):
+    # the same score as GameState.evaluate_position for every position that isn't over yet,
+    # terminal positions and draws by rule are not detected, returns a list with or without numpy
+    states = list(states)
+    if numpy is None:
+        return [state.compute_score() for state in states]
+    return evaluate_boards(boards_array(states)).tolist()
+
+def evaluate_packed(buffer):
+    if numpy is None:
+        return [_evaluate_packed_position(buffer, offset)
+                for offset in range(0, len(buffer)-PACKED_POSITION.size+1, PACKED_POSITION.size)]
+    positions = numpy.frombuffer(buffer, dtype=PACKED_DTYPE, count=len(buffer)//PACKED_POSITION.size)
+    scores = numpy.empty(len(positions), dtype=numpy.int64)
+    for i in range(0, len(positions), CHUNK_SIZE):
+        scores[i:i+CHUNK_SIZE] = evaluate_boards(_decode_boards(positions[i:i+CHUNK_SIZE]))
+    return scores.tolist()
+
+def _evaluate_packed_position(buffer, offset):
+    occupancy, _, _, _, _, pieces = PACKED_POSITION.unpack_from(buffer, offset)
+    pieces = int.from_bytes(pieces, 'little')
+    score = 0
+    while occupancy:
+        bit = occupancy & -occupancy
+        occupancy ^= bit
+        if not 0 < pieces & 15 <= 12:
+            raise ValueError("invalid packed position")
+        score += PIECE_SQUARE_VALUES[pieces & 15][SQ120[bit.bit_length()-1]]
+        pieces >>= 4
+    return score
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Writes the static score, positive for white, of every position in a file, one per line.")
+    parser.add_argument("input", help="a file of fen/epd lines or, with --packed, of packed positions")
+    parser.add_argument("--packed", action="store_true", help="the input holds 32 byte packed positions")
+    args = parser.parse_args(argv)
+
+    if args.packed:
+        with open(args.input, "rb") as f:
+            if not f.seek(0, 2):
+                return 0
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                scores = evaluate_packed(buffer)
+    else:
+        # fen lines are packed first, 32 bytes per position are easier to hold than a game state each
+        state = GameState(1)
+        packed = bytearray()
+        with open(args.input) as f:
+            for line in f:
+                if line.strip() and not line.startswith("#"):
+                    state.set_fen(parse_epd(line)[0])
+                    packed += state.to_packed()
+        scores = evaluate_packed(packed)
+    sys.stdout.writelines("%d\n" % score for score in scores)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+import multiprocessing
+import os
+import queue
+
+from chess import DEFAULT_HASH_MB, MATE_THRESHOLD, GameState, move_to_uci
+
+# every worker process keeps one GameState, and with it its transposition table, for its whole life
+_worker_state = None
+
+_progress = None
+
+def _init_worker(hash_size_mb, backend, stop_event, progress):
+    global _worker_state, _progress
+    _worker_state = GameState(hash_size_mb, backend)
+    _worker_state.stop_event = stop_event
+    _progress = progress
+
+def _search_root_moves(fen, past_states, root_moves, limits, report=None):
+    # with report, a (search, share) pair, every completed iteration is also sent back while the search runs
+    state = _worker_state
+    state.set_fen(fen)
+    state.past_states = past_states
+    iterations = []
+    def on_iteration(iteration):
+        iterations.append(iteration)
+        if report is not None:
+            # the workers keep their transposition tables to themselves, so each follows its own variation
+            _progress.put(report+(dict(iteration, pv=state.principal_variation(iteration["move"])),))
+    state.search(searchmoves=root_moves, on_iteration=on_iteration, **limits)
+    return iterations, state.nodes
+
+def _combine(shares, depth, is_whites_turn):
+    # the best of the workers' iterations at a depth, each worker only saw its own share of the root moves
+    best = None
+    for iterations in shares:
+        iteration = iterations[min(depth, len(iterations))-1]
+        if best is None or (iteration["score"] > best["score"] if is_whites_turn else iteration["score"] < best["score"]):
+            best = iteration
+    return best
+
+class SearchPool:
+    # splits the root moves of a position across a pool of worker processes, each of which
+    # runs its own iterative deepening search over its share of the moves
+
+    def __init__(self, workers=None, hash_size_mb=DEFAULT_HASH_MB, backend=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.hash_size_mb = hash_size_mb
+        self.backend = backend
+        self.nodes = 0
+        self.pool = None
+        self.stop_event = None
+        self.progress = None
+        self.searches = 0
+        if self.workers > 1:
+            self.stop_event = multiprocessing.Event()
+            self.progress = multiprocessing.Queue()
+            self.pool = multiprocessing.Pool(self.workers, _init_worker, (hash_size_mb, backend, self.stop_event, self.progress))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def stop(self):
+        if self.stop_event is not None:
+            self.stop_event.set()
+
+    def search(self, state, **limits):
+        # takes the same limits as GameState.search and returns its (move, value, depth) result,
+        # with a single worker the search runs in this process on the given state
+        if self.pool is None:
+            result = state.search(**limits)
+            self.nodes = state.nodes
+            return result
+        if state.book is not None:
+            book_move = state.book.choose_move(state, limits.get("searchmoves"))
+            if book_move:
+                self.nodes = 0
+                return book_move, state.score, 0
+        if state.tablebases is not None and not limits.get("searchmoves"):
+            result = state.tablebases.best_move(state)
+            if result is not None:
+                self.nodes = 0
+                return result[0], result[1], 0
+        moves = [move_to_uci(move) for move in state.generate_legal_moves()]
+        if limits.get("searchmoves"):
+            moves = [move for move in moves if move in limits["searchmoves"]] or moves
+        on_iteration = limits.get("on_iteration")
+        limits = {key: value for key, value in limits.items() if key not in ("searchmoves", "on_iteration")}
+        if len(moves) < 2:
+            result = state.search(searchmoves=moves, on_iteration=on_iteration, **limits)
+            self.nodes = state.nodes
+            return result
+        if limits.get("nodes") is not None:
+            limits = dict(limits, nodes=max(1, limits["nodes"]//min(self.workers, len(moves))))
+        shares = [moves[i::self.workers] for i in range(min(self.workers, len(moves)))]
+        self.stop_event.clear()
+        fen = state.to_fen()
+        self.searches += 1
+        jobs = [self.pool.apply_async(_search_root_moves, (fen, state.past_states, share, limits,
+                                                           (self.searches, i) if on_iteration is not None else None))
+                for i, share in enumerate(shares)]
+        if on_iteration is not None:
+            self.report_progress(jobs, on_iteration, state.is_whites_turn)
+        results = [job.get() for job in jobs]
+        self.nodes = sum(nodes for _, nodes in results)
+        # compare the workers at the deepest iteration every one of them completed, a worker
+        # that stopped early because it found a mate keeps its last, exact, result
+        unfinished = [len(iterations) for iterations, _ in results if abs(iterations[-1]["score"]) < MATE_THRESHOLD]
+        depth = min(unfinished) if unfinished else max(len(iterations) for iterations, _ in results)
+        best = _combine([iterations for iterations, _ in results], depth, state.is_whites_turn)
+        return best["move"], best["score"], depth
+
+    def report_progress(self, jobs, on_iteration, is_whites_turn):
+        # a depth is reported once every worker completed it, with the nodes all of them searched so far
+        shares = [[] for _ in jobs]
+        reported = 0
+        while not all(job.ready() for job in jobs) or not self.progress.empty():
+            try:
+                search, share, iteration = self.progress.get(timeout=0.01)
+            except queue.Empty:
+                continue
+            if search != self.searches:
+                continue
+            shares[share].append(iteration)
+            depth = min(len(iterations) for iterations in shares)
+            if depth > reported:
+                reported = depth
+                best = _combine(shares, depth, is_whites_turn)
+                on_iteration(dict(best, depth=depth, nodes=sum(iterations[-1]["nodes"] for iterations in shares),
+                                  time=max(iterations[depth-1]["time"] for iterations in shares)))
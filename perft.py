@@ -0,0 +1,125 @@
+import argparse
+import json
+import platform
+import sys
+import time
+
+from chess import BACKENDS, GameState
+
+# node counts for depth 1, 2, 3, ... of the usual move generator test positions
+POSITIONS = [
+    ("initial", "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+     [20, 400, 8902, 197281, 4865609, 119060324]),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     [48, 2039, 97862, 4085603, 193690690]),
+    ("position3", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     [14, 191, 2812, 43238, 674624, 11030083]),
+    ("position4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     [6, 264, 9467, 422333, 15833292]),
+    ("position4-mirrored", "r2q1rk1/pP1p2pp/Q4n2/bbp1p3/Np6/1B3NBn/pPPP1PPP/R3K2R b KQ - 0 1",
+     [6, 264, 9467, 422333, 15833292]),
+    ("position5", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     [44, 1486, 62379, 2103487, 89941194]),
+    ("position6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     [46, 2079, 89890, 3894594, 164075551]),
+    ("illegal-en-passant-1", "3k4/3p4/8/K1P4r/8/8/8/8 b - - 0 1",
+     [18, 92, 1670, 10138, 185429, 1134888]),
+    ("illegal-en-passant-2", "8/8/4k3/8/2p5/8/B2P2K1/8 w - - 0 1",
+     [13, 102, 1266, 10276, 135655, 1015133]),
+    ("en-passant-gives-check", "8/8/1k6/2b5/2pP4/8/5K2/8 b - d3 0 1",
+     [15, 126, 1928, 13931, 206379, 1440467]),
+    ("short-castling-gives-check", "5k2/8/8/8/8/8/8/4K2R w K - 0 1",
+     [15, 66, 1198, 6399, 120330, 661072]),
+    ("long-castling-gives-check", "3k4/8/8/8/8/8/8/R3K3 w Q - 0 1",
+     [16, 71, 1286, 7418, 141077, 803711]),
+    ("castle-rights", "r3k2r/1b4bq/8/8/8/8/7B/R3K2R w KQkq - 0 1",
+     [26, 1141, 27826, 1274206]),
+    ("castling-prevented", "r3k2r/8/3Q4/8/8/5q2/8/R3K2R b KQkq - 0 1",
+     [44, 1494, 50509, 1720476]),
+    ("promote-out-of-check", "2K2r2/4P3/8/8/8/8/8/3k4 w - - 0 1",
+     [11, 133, 1442, 19174, 266199, 3821001]),
+    ("discovered-check", "8/8/1P2K3/8/2n5/1q6/8/5k2 b - - 0 1",
+     [29, 165, 5160, 31961, 1004658]),
+    ("promote-to-give-check", "4k3/1P6/8/8/8/8/K7/8 w - - 0 1",
+     [9, 40, 472, 2661, 38983, 217342]),
+    ("under-promote-to-give-check", "8/P1k5/K7/8/8/8/8/8 w - - 0 1",
+     [6, 27, 273, 1329, 18135, 92683]),
+    ("self-stalemate", "K1k5/8/P7/8/8/8/8/8 w - - 0 1",
+     [2, 6, 13, 63, 382, 2217]),
+    ("stalemate-and-checkmate", "8/k1P5/8/1K6/8/8/8/8 w - - 0 1",
+     [10, 25, 268, 926, 10857, 43261, 567584]),
+    ("double-check", "8/8/2k5/5q2/5n2/8/5K2/8 b - - 0 1",
+     [37, 183, 6559, 23527]),
+]
+
+def run_position(name, fen, expected, depth, backend):
+    state = GameState(backend=backend)
+    state.set_fen(fen)
+    depth = min(depth, len(expected))
+    start = time.perf_counter()
+    nodes = state.perft(depth)
+    seconds = time.perf_counter()-start
+    return {
+        "name": name,
+        "fen": fen,
+        "depth": depth,
+        "nodes": nodes,
+        "expected": expected[depth-1],
+        "ok": nodes == expected[depth-1],
+        "seconds": round(seconds, 6),
+        "nps": int(nodes/seconds) if seconds > 0 else 0,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Checks the move generator against known perft node counts and reports its speed.")
+    parser.add_argument("--depth", type=int, default=4, help="maximum depth per position (default: 4)")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="mailbox")
+    parser.add_argument("--position", action="append", help="only run the named position, can be repeated")
+    parser.add_argument("--fen", help="run a divide on this position instead of the test suite")
+    parser.add_argument("--json", metavar="FILE", help="also write the results as json, '-' for stdout")
+    args = parser.parse_args(argv)
+
+    if args.fen:
+        state = GameState(backend=args.backend)
+        state.set_fen(args.fen)
+        counts = state.divide(args.depth)
+        for move in sorted(counts):
+            print(move, counts[move])
+        print("total", sum(counts.values()))
+        return 0
+
+    out = sys.stderr if args.json == "-" else sys.stdout
+    positions = [position for position in POSITIONS if not args.position or position[0] in args.position]
+    results = []
+    for name, fen, expected in positions:
+        result = run_position(name, fen, expected, args.depth, args.backend)
+        results.append(result)
+        print("%-28s depth %d %10d nodes %8.2fs %9d nps  %s" % (
+            name, result["depth"], result["nodes"], result["seconds"], result["nps"],
+            "ok" if result["ok"] else "FAILED, expected %d" % result["expected"]), file=out)
+    nodes = sum(result["nodes"] for result in results)
+    seconds = sum(result["seconds"] for result in results)
+    failed = [result["name"] for result in results if not result["ok"]]
+    print("%d nodes in %.2fs, %d nps, %d failed" % (nodes, seconds, nodes/seconds if seconds else 0, len(failed)), file=out)
+
+    if args.json:
+        report = {
+            "backend": args.backend,
+            "python": platform.python_implementation()+" "+platform.python_version(),
+            "timestamp": int(time.time()),
+            "nodes": nodes,
+            "seconds": round(seconds, 6),
+            "nps": int(nodes/seconds) if seconds else 0,
+            "failed": failed,
+            "results": results,
+        }
+        if args.json == "-":
+            json.dump(report, sys.stdout, indent=2)
+            print()
+        else:
+            with open(args.json, "w") as f:
+                json.dump(report, f, indent=2)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
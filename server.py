@@ -0,0 +1,344 @@
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import itertools
+import json
+import os
+import sys
+import time
+
+from chess import BACKENDS, DEFAULT_HASH_MB, SQUARES, START_FEN, GameState
+
+DEFAULT_MOVETIME_MS = 1000
+MAX_MOVETIME_MS = 60000
+IDLE_TIMEOUT = 600
+MAX_SESSIONS = 10000
+# a search that overruns its budget by this much is answered with an error instead of waiting for it
+RESULT_GRACE = 5
+
+# the state of a search worker, the book and tablebases it opens are memory mapped and so shared
+# through the page cache, _worker_game is the game its history heuristic was last filled by
+_worker_state = None
+_worker_game = None
+
+def _init_worker(hash_size_mb, backend, book_path, tablebase_path):
+    global _worker_state
+    _worker_state = GameState(hash_size_mb, backend)
+    if book_path:
+        from book import OpeningBook
+        _worker_state.book = OpeningBook(book_path)
+    if tablebase_path:
+        from tablebase import Tablebases
+        _worker_state.tablebases = Tablebases(tablebase_path)
+
+def _search(game, fen, past_states, deadline, limits):
+    global _worker_game
+    state = _worker_state
+    if game != _worker_game:
+        # the history heuristic learns about one game, the transposition table is keyed by
+        # the position and stays useful for any game, so only the history is dropped
+        for piece_history in state.history:
+            for sq in SQUARES:
+                piece_history[sq] = 0
+        _worker_game = game
+    state.set_fen(fen)
+    state.past_states = past_states
+    # the budget started when the request came in, time spent in the queue counts against it
+    movetime = max(1, int((deadline-time.time())*1000))
+    move, value, depth = state.search(movetime=movetime, **limits)
+    return move, value, depth, state.nodes
+
+class RequestError(Exception):
+    pass
+
+def game_id(game):
+    # games are named by strings, numbers are taken as their string so 5 and "5" are the same game
+    if isinstance(game, bool) or not isinstance(game, (str, int)):
+        raise RequestError("a game is named by a string")
+    return str(game)
+
+class Session:
+    # a game is just its position and the repetition counts of the positions that led to it,
+    # moves are checked and made on the server's one scratch GameState
+
+    def __init__(self, fen, past_states):
+        self.fen = fen
+        self.past_states = past_states
+        self.searching = False
+        self.last_used = time.monotonic()
+
+class GameServer:
+    # runs many games at once: requests are json lines, searches go to a shared pool of worker
+    # processes with a bounded queue, and games nobody touched for a while are dropped
+
+    def __init__(self, workers=None, hash_size_mb=DEFAULT_HASH_MB, backend=None, max_pending=None,
+                 max_sessions=MAX_SESSIONS, idle_timeout=IDLE_TIMEOUT, default_movetime=DEFAULT_MOVETIME_MS,
+                 max_movetime=MAX_MOVETIME_MS, book_path=None, tablebase_path=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or 4*self.workers
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.default_movetime = default_movetime
+        self.max_movetime = max_movetime
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            self.workers, initializer=_init_worker, initargs=(hash_size_mb, backend, book_path, tablebase_path))
+        # the least recently used games come first
+        self.sessions = collections.OrderedDict()
+        self.game_ids = itertools.count(1)
+        self.pending = 0
+        self.searches = 0
+        self.state = GameState(0, backend)
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def handle(self, request):
+        op = request.get("op")
+        if op == "new":
+            return self.new_game(request)
+        if op == "stats":
+            return {"games": len(self.sessions), "pending": self.pending, "workers": self.workers,
+                    "max_pending": self.max_pending, "searches": self.searches}
+        game = game_id(request.get("game"))
+        session = self.session(game)
+        if op == "show":
+            return self.show(session)
+        if op == "move":
+            if session.searching:
+                raise RequestError("a search is running in this game")
+            return self.make_move(session, request.get("move"))
+        if op == "go":
+            return await self.go(game, session, request)
+        if op == "close":
+            if session.searching:
+                raise RequestError("a search is running in this game")
+            del self.sessions[game]
+            return {"game": game, "closed": True}
+        raise RequestError("unknown op %r" % op)
+
+    def session(self, game):
+        if game not in self.sessions:
+            raise RequestError("no game %r" % game)
+        session = self.sessions[game]
+        session.last_used = time.monotonic()
+        self.sessions.move_to_end(game)
+        return session
+
+    def new_game(self, request):
+        game = request.get("game")
+        game = "g%d" % next(self.game_ids) if game is None else game_id(game)
+        if game in self.sessions and self.sessions[game].searching:
+            raise RequestError("a search is running in this game")
+        if game not in self.sessions and len(self.sessions) >= self.max_sessions:
+            self.evict_idle()
+            if len(self.sessions) >= self.max_sessions:
+                raise RequestError("too many games")
+        fen = request.get("fen") or START_FEN
+        moves = request.get("moves", [])
+        if not isinstance(fen, str):
+            raise RequestError("a fen is a string")
+        if not isinstance(moves, list) or not all(isinstance(move, str) for move in moves):
+            raise RequestError("moves are a list of strings")
+        state = self.state
+        try:
+            state.set_fen(fen)
+            state.check_position()
+        except (ValueError, IndexError) as error:
+            raise RequestError(str(error) or "invalid fen")
+        session = Session(state.to_fen(), state.past_states)
+        for move in moves:
+            self.make_move(session, move)
+        self.sessions[game] = session
+        self.sessions.move_to_end(game)
+        return dict(self.show(session), game=game)
+
+    def load(self, session):
+        state = self.state
+        state.set_fen(session.fen)
+        state.past_states = session.past_states
+        return state
+
+    def show(self, session):
+        state = self.load(session)
+        moves = state.next_legal_moves()
+        if not moves:
+            status = "checkmate" if state.is_in_check() else "stalemate"
+        else:
+            status = "draw" if state.is_draw_by_rule() else "ongoing"
+        return {"fen": session.fen, "moves": moves, "status": status}
+
+    def make_move(self, session, move):
+        state = self.load(session)
+        if not isinstance(move, str) or move not in state.next_legal_moves():
+            raise RequestError("illegal move %r" % move)
+        state.make_move(move)
+        if not state.halfmove_clock:
+            # positions before a capture or pawn move can't come back, no need to count them any more
+            state.past_states = {state.hash: 1}
+        session.fen, session.past_states = state.to_fen(), state.past_states
+        return self.show(session)
+
+    async def go(self, game, session, request):
+        if session.searching:
+            raise RequestError("a search is running in this game")
+        if self.pending >= self.max_pending:
+            raise RequestError("busy")
+        status = self.show(session)["status"]
+        if status != "ongoing":
+            raise RequestError("the game is over: "+status)
+        try:
+            movetime = min(int(request.get("movetime", self.default_movetime)), self.max_movetime)
+            limits = {key: int(request[key]) for key in ("depth", "nodes") if request.get(key) is not None}
+            if movetime < 1 or any(value < 1 for value in limits.values()):
+                raise ValueError
+        except (TypeError, ValueError):
+            raise RequestError("invalid search limits")
+        start = time.time()
+        loop = asyncio.get_running_loop()
+        future = self.executor.submit(_search, game, session.fen, session.past_states, start+movetime/1000, limits)
+        # a running search can't be cancelled, one that outlives its answer keeps its place in the
+        # queue until the worker is really done with it
+        self.pending += 1
+        def release(future):
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(self.release_pending)
+        future.add_done_callback(release)
+        session.searching = True
+        try:
+            try:
+                move, value, depth, nodes = await asyncio.wait_for(asyncio.wrap_future(future), movetime/1000+RESULT_GRACE)
+            except asyncio.TimeoutError:
+                raise RequestError("the search ran out of time")
+        finally:
+            session.searching = False
+            session.last_used = time.monotonic()
+        self.searches += 1
+        result = {"game": game, "move": move or None, "score": value, "depth": depth, "nodes": nodes,
+                  "time": round(time.time()-start, 6)}
+        if request.get("play") and move:
+            result.update(self.make_move(session, move))
+        return result
+
+    def release_pending(self):
+        self.pending -= 1
+
+    def evict_idle(self):
+        cutoff = time.monotonic()-self.idle_timeout
+        for game in list(self.sessions):
+            session = self.sessions[game]
+            if session.last_used > cutoff:
+                break
+            if not session.searching:
+                del self.sessions[game]
+
+    async def evict_periodically(self):
+        while True:
+            await asyncio.sleep(max(1, self.idle_timeout/4))
+            self.evict_idle()
+
+    async def respond(self, line, send):
+        request = {}
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                request = {}
+                raise RequestError("a request is a json object")
+            response = await self.handle(request)
+        except json.JSONDecodeError:
+            response = {"error": "invalid json"}
+        except RequestError as error:
+            response = {"error": str(error)}
+        except Exception as error:
+            # like a broken worker pool, every request gets an answer whatever went wrong
+            response = {"error": "internal error: %s" % (str(error) or type(error).__name__)}
+        if "id" in request:
+            response["id"] = request["id"]
+        await send(json.dumps(response))
+
+    async def serve_connection(self, reader, writer):
+        # every request runs as its own task, so one game's search doesn't hold up the others,
+        # responses carry the request's id and come back in the order they finish
+        lock = asyncio.Lock()
+        tasks = set()
+        async def send(line):
+            async with lock:
+                writer.write(line.encode()+b"\n")
+                await writer.drain()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.strip():
+                    task = asyncio.create_task(self.respond(line, send))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.wait(tasks)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    async def serve_stdio(self):
+        loop = asyncio.get_running_loop()
+        tasks = set()
+        async def send(line):
+            print(line, flush=True)
+        while True:
+            line = await loop.run_in_executor(None, sys.stdin.readline)
+            if not line:
+                break
+            if line.strip():
+                task = asyncio.create_task(self.respond(line, send))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.wait(tasks)
+
+async def serve(server, host=None, port=None, unix=None):
+    evictor = asyncio.create_task(server.evict_periodically())
+    try:
+        if unix:
+            listener = await asyncio.start_unix_server(server.serve_connection, unix)
+        elif port is not None:
+            listener = await asyncio.start_server(server.serve_connection, host, port)
+        else:
+            await server.serve_stdio()
+            return
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        evictor.cancel()
+        server.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Plays many games at once over a json lines protocol on stdin/stdout or a local socket.")
+    parser.add_argument("--port", type=int, help="listen on this tcp port instead of stdin/stdout")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--unix", help="listen on this unix socket instead of stdin/stdout")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--max-pending", type=int, help="searches queued or running at once before requests are turned away (default: 4 per worker)")
+    parser.add_argument("--max-games", type=int, default=MAX_SESSIONS)
+    parser.add_argument("--idle-timeout", type=float, default=IDLE_TIMEOUT, help="seconds after which an unused game is dropped")
+    parser.add_argument("--movetime", type=int, default=DEFAULT_MOVETIME_MS, help="milliseconds per search when a request gives none")
+    parser.add_argument("--max-movetime", type=int, default=MAX_MOVETIME_MS)
+    parser.add_argument("--hash", type=int, default=DEFAULT_HASH_MB, help="transposition table size per worker in MB")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="mailbox")
+    parser.add_argument("--book", help="a polyglot opening book")
+    parser.add_argument("--tablebases", help="a directory of tablebase.py endgame tables")
+    args = parser.parse_args(argv)
+
+    server = GameServer(args.workers, args.hash, args.backend, args.max_pending, args.max_games, args.idle_timeout,
+                        args.movetime, args.max_movetime, args.book, args.tablebases)
+    try:
+        asyncio.run(serve(server, args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        return 130
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
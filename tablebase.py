@@ -0,0 +1,432 @@
+import argparse
+import mmap
+import os
+import struct
+import sys
+import time
+
+from chess import (BISHOP_OFFSETS, BLACK_KING, BLACK_PAWN, KING_OFFSETS, KNIGHT_OFFSETS, MATE_VALUE, OFFBOARD,
+                   QUEEN_OFFSETS, ROOK_OFFSETS, SQ64, SQ120, SQUARES, WHITE_KING, WHITE_PAWN,
+                   GameState, move_to_uci)
+
+# tables are named by their material, white's pieces before the 'v' and black's after it, like KRvK,
+# the stronger side is always white, positions where black is stronger are probed with the colors flipped
+PIECE_LETTERS = 'KQRBNP'
+WHITE_PIECE_CODES = {'K': WHITE_KING, 'Q': WHITE_KING-1, 'R': WHITE_KING-2, 'B': WHITE_KING-3, 'N': WHITE_KING-4, 'P': WHITE_PAWN}
+PIECE_LETTER = {code: letter for letter, code in WHITE_PIECE_CODES.items()}
+PIECE_LETTER.update({code+6: letter for letter, code in WHITE_PIECE_CODES.items()})
+PIECE_MOVES = {'K': (KING_OFFSETS, False), 'Q': (QUEEN_OFFSETS, True), 'R': (ROOK_OFFSETS, True),
+               'B': (BISHOP_OFFSETS, True), 'N': (KNIGHT_OFFSETS, False)}
+MAX_PIECES = 4
+
+# one byte per position, from the side to move: 0 is a draw (or a position that can't occur),
+# an odd byte b a loss in b-1 plies and an even byte b a win in b-1 plies
+DRAW = 0
+MAX_PLIES = 253
+INVALID = 255
+HEADER = struct.Struct('<4sBB16s')
+MAGIC = b'CFTB'
+VERSION = 1
+
+# the 8 symmetries of the board on 0..63 squares, bit 0 flips the files, bit 1 the ranks and
+# bit 2 mirrors along the a1-h8 diagonal after the flips
+TRANSFORMS = []
+for _t in range(8):
+    _map = []
+    for _sq in range(64):
+        _sq = _sq ^ 7 if _t & 1 else _sq
+        _sq = _sq ^ 56 if _t & 2 else _sq
+        _map.append((_sq & 7) << 3 | _sq >> 3 if _t & 4 else _sq)
+    TRANSFORMS.append(_map)
+
+def king_transforms(sq, pawns):
+    # the symmetries that move the white king into a1-d1-d4 (a-d files with pawns), two of them when
+    # it ends up on the diagonal, then the other pieces decide
+    file, rank = sq & 7, sq >> 3
+    if pawns:
+        return [1 if file > 3 else 0]
+    t = (1 if file > 3 else 0) | (2 if rank > 3 else 0)
+    sq = TRANSFORMS[t][sq]
+    if sq >> 3 > sq & 7:
+        return [t | 4]
+    if sq >> 3 == sq & 7:
+        return [t, t | 4]
+    return [t]
+
+def split_signature(signature):
+    white, _, black = signature.partition('v')
+    if not white.startswith('K') or not black.startswith('K') or not set(white+black) <= set(PIECE_LETTERS):
+        raise ValueError("invalid tablebase material: "+signature)
+    return white, black
+
+def material_key(letters):
+    return (-len(letters), sorted(PIECE_LETTERS.index(letter) for letter in letters))
+
+def canonical_signature(white, black):
+    # returns the name of the table and whether the colors have to be flipped to probe it
+    white = 'K'+''.join(sorted(white.replace('K', ''), key=PIECE_LETTERS.index))
+    black = 'K'+''.join(sorted(black.replace('K', ''), key=PIECE_LETTERS.index))
+    if material_key(black[1:]) < material_key(white[1:]):
+        return black+'v'+white, True
+    return white+'v'+black, False
+
+def sub_signatures(signature):
+    # the endings a capture or a promotion leads to, bare kings are a draw and have no table
+    white, black = split_signature(signature)
+    endings = set()
+    for side, other, flip in ((white, black, False), (black, white, True)):
+        for i, letter in enumerate(side):
+            if letter == 'K':
+                continue
+            rest = side[:i]+side[i+1:]
+            if rest != 'K' or other != 'K':
+                endings.add(canonical_signature(*((other, rest) if flip else (rest, other)))[0])
+            if letter == 'P':
+                for promotion in 'QRBN':
+                    endings.add(canonical_signature(*((other, rest+promotion) if flip else (rest+promotion, other)))[0])
+    return sorted(endings)
+
+class Layout:
+    # maps the positions of one ending to table indices, the white king is the first piece and
+    # is moved into a small corner region by a symmetry of the board, all other pieces follow it
+
+    def __init__(self, signature):
+        white, black = split_signature(signature)
+        self.signature = signature
+        self.pieces = [WHITE_PIECE_CODES[letter] for letter in white]+[WHITE_PIECE_CODES[letter]+6 for letter in black]
+        self.letters = list(white+black)
+        self.white = [True]*len(white)+[False]*len(black)
+        self.pawns = 'P' in signature
+        self.king_squares = [sq for sq in range(64) if TRANSFORMS[king_transforms(sq, self.pawns)[0]][sq] == sq]
+        self.king_slot = {sq: slot for slot, sq in enumerate(self.king_squares)}
+        self.transforms = [king_transforms(sq, self.pawns) for sq in range(64)]
+        self.half = len(self.king_squares)*64**(len(self.pieces)-1)
+        self.size = 2*self.half
+
+    def index(self, squares, black_to_move):
+        best = None
+        for t in self.transforms[squares[0]]:
+            transform = TRANSFORMS[t]
+            index = self.king_slot[transform[squares[0]]]
+            for sq in squares[1:]:
+                index = index*64+transform[sq]
+            if best is None or index < best:
+                best = index
+        return best+self.half if black_to_move else best
+
+    def decode(self, index):
+        black_to_move = index >= self.half
+        index -= self.half if black_to_move else 0
+        squares = []
+        for _ in range(len(self.pieces)-1):
+            squares.append(index % 64)
+            index //= 64
+        squares.append(self.king_squares[index])
+        squares.reverse()
+        return squares, black_to_move
+
+class Tablebases:
+    # probes the tables of a directory, each file is memory mapped the first time it is needed
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.tables = {}
+        self.layouts = {}
+        self.max_pieces = 0
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                if name.endswith('.tb'):
+                    self.max_pieces = max(self.max_pieces, len(name)-4)
+
+    def close(self):
+        for table in self.tables.values():
+            if table is not None:
+                table.close()
+        self.tables = {}
+
+    def table(self, signature):
+        if signature not in self.tables:
+            path = os.path.join(self.directory, signature+'.tb')
+            table = None
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    table = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                magic, version, pieces, name = HEADER.unpack_from(table)
+                if magic != MAGIC or version != VERSION or name.rstrip(b'\0').decode() != signature:
+                    table.close()
+                    raise ValueError("not a tablebase for %s: %s" % (signature, path))
+                self.layouts[signature] = Layout(signature)
+                self.max_pieces = max(self.max_pieces, pieces)
+            self.tables[signature] = table
+        return self.tables[signature]
+
+    def probe(self, state):
+        # the result for the side to move as (1, 0 or -1, plies to mate), None if there is no table
+        board = state.board
+        count = 120-board.count(0)-board.count(OFFBOARD)
+        if count == 2:
+            return 0, 0
+        if count > self.max_pieces or state.castling_rights:
+            return None
+        white, black = [], []
+        for sq in SQUARES:
+            piece = board[sq]
+            if piece:
+                (white if piece < BLACK_PAWN else black).append((PIECE_LETTERS.index(PIECE_LETTER[piece]), SQ64[sq]))
+        if state.en_passant_square:
+            # only tables without en passant rights exist, which is fine as long as no pawn can use them
+            pawn = WHITE_PAWN if state.is_whites_turn else BLACK_PAWN
+            behind = state.en_passant_square+(-10 if state.is_whites_turn else 10)
+            if board[behind-1] == pawn or board[behind+1] == pawn:
+                return None
+        white.sort()
+        black.sort()
+        signature, flipped = canonical_signature(''.join(PIECE_LETTERS[i] for i, _ in white),
+                                                 ''.join(PIECE_LETTERS[i] for i, _ in black))
+        table = self.table(signature)
+        if table is None:
+            return None
+        if flipped:
+            squares = [sq ^ 56 for _, sq in black]+[sq ^ 56 for _, sq in white]
+            black_to_move = state.is_whites_turn
+        else:
+            squares = [sq for _, sq in white]+[sq for _, sq in black]
+            black_to_move = not state.is_whites_turn
+        value = table[HEADER.size+self.layouts[signature].index(squares, black_to_move)]
+        if value == DRAW or value == INVALID:
+            return 0, 0
+        return (1 if value % 2 == 0 else -1), value-1
+
+    def probe_score(self, state, ply=0):
+        # the exact search value, from white's point of view like the rest of the search
+        result = self.probe(state)
+        if result is None:
+            return None
+        wdl, plies = result
+        if not wdl:
+            return 0
+        value = wdl*(MATE_VALUE-ply-plies)
+        return value if state.is_whites_turn else -value
+
+    def best_move(self, state):
+        # the fastest mate, or the longest defence, with the search value of the position
+        if self.probe(state) is None:
+            return None
+        best_move, best_value = None, None
+        for move in state.generate_legal_moves():
+            state.make_move(move)
+            result = self.probe(state)
+            state.unmake_move()
+            if result is None:
+                continue
+            value = (-result[0], result[1]+1)
+            if best_value is None or exit_order(value) > exit_order(best_value):
+                best_move, best_value = move, value
+        if best_move is None:
+            return None
+        return move_to_uci(best_move), self.probe_score(state)
+
+def generate(signature, directory, log=None):
+    # retrograde analysis of one ending, the endings it can turn into are generated first
+    signature = canonical_signature(*split_signature(signature))[0]
+    path = os.path.join(directory, signature+'.tb')
+    if os.path.exists(path):
+        return path
+    if len(signature)-1 > MAX_PIECES:
+        raise ValueError("at most %d pieces are supported: %s" % (MAX_PIECES, signature))
+    os.makedirs(directory, exist_ok=True)
+    for ending in sub_signatures(signature):
+        generate(ending, directory, log)
+    start = time.monotonic()
+    layout = Layout(signature)
+    tablebases = Tablebases(directory)
+    state = GameState(hash_size_mb=0)
+    board = state.board
+    state.castling_rights = 0
+    state.en_passant_square = 0
+    for sq in SQUARES:
+        board[sq] = 0
+    pieces = layout.pieces
+    letters = layout.letters
+    white = layout.white
+    kings = [pieces.index(WHITE_KING), pieces.index(BLACK_KING)]
+    size = layout.size
+    values = bytearray(size)
+    counts = bytearray(size)
+    best_exits = {}
+    buckets = [[] for _ in range(MAX_PLIES+2)]
+
+    def place(squares):
+        for piece, sq in zip(pieces, squares):
+            board[SQ120[sq]] = piece
+
+    def clear(squares):
+        for sq in squares:
+            board[SQ120[sq]] = 0
+
+    # first pass: find the positions that can't occur, count the moves that stay in this ending
+    # and score the moves that leave it from the tables of the smaller endings
+    for index in range(size):
+        squares, black_to_move = layout.decode(index)
+        if len(set(squares)) < len(squares) or layout.index(squares, black_to_move) != index or \
+                any(letter == 'P' and not 8 <= sq < 56 for letter, sq in zip(letters, squares)):
+            counts[index] = INVALID
+            continue
+        place(squares)
+        state.is_whites_turn = not black_to_move
+        if state.is_king_attacked(black_to_move):
+            counts[index] = INVALID
+            clear(squares)
+            continue
+        moves = state.generate_legal_moves()
+        if not moves:
+            if state.is_in_check():
+                buckets[0].append(index)
+            clear(squares)
+            continue
+        children = set()
+        best_exit = None
+        for move in moves:
+            if board[move >> 7 & 127] or move >> 14 & 15:
+                state.make_move(move)
+                result = tablebases.probe(state)
+                state.unmake_move()
+                wdl, plies = result
+                value = (-wdl, plies+1)
+                if best_exit is None or exit_order(value) > exit_order(best_exit):
+                    best_exit = value
+            else:
+                moved = squares.index(SQ64[move & 127])
+                children.add(layout.index(squares[:moved]+[SQ64[move >> 7 & 127]]+squares[moved+1:], not black_to_move))
+        clear(squares)
+        counts[index] = len(children)
+        if best_exit is not None:
+            best_exits[index] = best_exit
+            if best_exit[0] > 0:
+                buckets[best_exit[1]].append(index)
+            elif not children and best_exit[0] < 0:
+                buckets[best_exit[1]].append(index)
+
+    # then mates spread backwards one ply at a time: a position is won once one move reaches a
+    # lost position, and lost once every move reaches a won one
+    for plies in range(MAX_PLIES+1):
+        won = plies % 2 == 1
+        for index in buckets[plies]:
+            if values[index]:
+                continue
+            values[index] = plies+1
+            squares, black_to_move = layout.decode(index)
+            place(squares)
+            predecessors = set()
+            # the side that just moved, unmove each of its pieces
+            mover_white = black_to_move
+            for i, (letter, sq) in enumerate(zip(letters, squares)):
+                if white[i] != mover_white:
+                    continue
+                target = SQ120[sq]
+                origins = []
+                if letter == 'P':
+                    step = -10 if mover_white else 10
+                    origin = target+step
+                    if board[origin] == 0 and 8 <= SQ64[origin] < 56:
+                        origins.append(origin)
+                        start_rank = 1 if mover_white else 6
+                        if board[origin+step] == 0 and SQ64[origin+step] >> 3 == start_rank:
+                            origins.append(origin+step)
+                else:
+                    offsets, slides = PIECE_MOVES[letter]
+                    for offset in offsets:
+                        origin = target+offset
+                        while board[origin] == 0:
+                            origins.append(origin)
+                            if not slides:
+                                break
+                            origin += offset
+                for origin in origins:
+                    board[target] = 0
+                    board[origin] = pieces[i]
+                    # the side to move now can't have been in check before the move
+                    if not state.is_square_attacked(board.index(pieces[kings[1 if mover_white else 0]]), mover_white):
+                        predecessors.add(layout.index(squares[:i]+[SQ64[origin]]+squares[i+1:], not mover_white))
+                    board[origin] = 0
+                    board[target] = pieces[i]
+            clear(squares)
+            for predecessor in predecessors:
+                if values[predecessor] or counts[predecessor] == INVALID:
+                    continue
+                if not won:
+                    buckets[plies+1].append(predecessor)
+                    continue
+                counts[predecessor] -= 1
+                if counts[predecessor]:
+                    continue
+                best_exit = best_exits.get(predecessor)
+                if best_exit is None:
+                    buckets[plies+1].append(predecessor)
+                elif best_exit[0] < 0:
+                    buckets[max(plies+1, best_exit[1])].append(predecessor)
+        buckets[plies] = None
+    if any(buckets[MAX_PLIES+1]):
+        raise ValueError("mates longer than %d plies can't be stored: %s" % (MAX_PLIES, signature))
+
+    tablebases.close()
+    for index in range(size):
+        if counts[index] == INVALID:
+            values[index] = INVALID
+    with open(path+'.tmp', 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(pieces), signature.encode()))
+        f.write(values)
+    os.replace(path+'.tmp', path)
+    if log is not None:
+        log("%s: %d positions in %.1fs" % (signature, size, time.monotonic()-start))
+    return path
+
+def exit_order(value):
+    # orders results from the mover's side: fast wins, then draws, then slow losses
+    wdl, plies = value
+    return (wdl, -plies if wdl > 0 else plies)
+
+def all_signatures(pieces):
+    endings = set()
+    def extend(white, black):
+        if len(white)+len(black) == pieces:
+            if white != 'K' or black != 'K':
+                endings.add(canonical_signature(white, black)[0])
+            return
+        for letter in PIECE_LETTERS[1:]:
+            extend(white+letter, black)
+            extend(white, black+letter)
+    extend('K', 'K')
+    return sorted(endings, key=lambda signature: (len(signature), signature))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generates and probes distance to mate tablebases for small endings.")
+    parser.add_argument("--directory", default="tablebases", help="where the tables are kept (default: tablebases)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    generate_parser = commands.add_parser("generate", help="generate tables, every 3 piece ending by default")
+    generate_parser.add_argument("endings", nargs="*", help="endings like KQvK or KRvKP")
+    generate_parser.add_argument("--pieces", type=int, default=3, choices=range(3, MAX_PIECES+1),
+                                 help="generate every ending with this many pieces")
+    probe_parser = commands.add_parser("probe", help="probe a position")
+    probe_parser.add_argument("fen")
+    args = parser.parse_args(argv)
+
+    if args.command == "generate":
+        for ending in args.endings or all_signatures(args.pieces):
+            generate(ending, args.directory, log=print)
+        return 0
+    state = GameState(hash_size_mb=0)
+    state.set_fen(args.fen)
+    tablebases = Tablebases(args.directory)
+    result = tablebases.probe(state)
+    if result is None:
+        print("not in the tablebases")
+        return 1
+    wdl, plies = result
+    best = tablebases.best_move(state)
+    print(("win" if wdl > 0 else "loss" if wdl < 0 else "draw")+(" in %d plies" % plies if wdl else ""),
+          "best move "+best[0] if best else "")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
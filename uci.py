@@ -0,0 +1,302 @@
+import os
+import sys
+import threading
+import time
+
+from book import OpeningBook
+from chess import BACKENDS, DEFAULT_HASH_MB, MATE_THRESHOLD, MATE_VALUE, START_FEN, GameState
+from parallel import SearchPool
+from tablebase import Tablebases
+
+MAX_HASH_MB = 4096
+MAX_THREADS = 256
+TIME_LIMITS = ("movetime", "wtime", "btime", "winc", "binc", "movestogo")
+
+def format_score(value, is_whites_turn):
+    # search values are from white's point of view, uci wants them from the side to move
+    if not is_whites_turn:
+        value = -value
+    if abs(value) >= MATE_THRESHOLD:
+        plies = MATE_VALUE-abs(value)
+        return "mate %d" % ((plies+1)//2 if value > 0 else -((plies+1)//2))
+    return "cp %d" % value
+
+def parse_go(tokens):
+    limits = {}
+    ponder = infinite = False
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token in ("wtime", "btime", "winc", "binc", "movestogo", "depth", "nodes", "movetime", "mate") and i+1 < len(tokens):
+            value = int(tokens[i+1])
+            if token == "mate":
+                limits["depth"] = 2*value
+            else:
+                limits[token] = value
+            i += 2
+        elif token == "searchmoves":
+            moves = []
+            i += 1
+            while i < len(tokens) and tokens[i] not in ("wtime", "btime", "winc", "binc", "movestogo", "depth",
+                                                         "nodes", "movetime", "mate", "ponder", "infinite"):
+                moves.append(tokens[i])
+                i += 1
+            limits["searchmoves"] = moves
+        else:
+            ponder = ponder or token == "ponder"
+            infinite = infinite or token == "infinite"
+            i += 1
+    return limits, ponder, infinite
+
+class UciEngine:
+
+    def __init__(self, output=sys.stdout):
+        self.output = output
+        self.output_lock = threading.Lock()
+        self.hash_size_mb = DEFAULT_HASH_MB
+        self.threads = 1
+        self.backend = "mailbox"
+        self.state = GameState(self.hash_size_mb, self.backend)
+        self.own_book = False
+        self.book_file = ""
+        self.pool = None
+        self.search_thread = None
+        # set by stop/ponderhit, the bestmove of a ponder or infinite search has to wait for one of them
+        self.release = threading.Event()
+        self.stop_event = threading.Event()
+        self.ponder_limits = None
+        self.stop_timer = None
+
+    def send(self, line):
+        with self.output_lock:
+            print(line, file=self.output, flush=True)
+
+    def run(self, lines=sys.stdin):
+        for line in lines:
+            if not self.handle(line):
+                break
+        self.quit()
+
+    def handle(self, line):
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, args = tokens[0], tokens[1:]
+        if command == "quit":
+            return False
+        if command == "uci":
+            self.send("id name chess-from-scratch")
+            self.send("id author Alexander Pfefferle")
+            self.send("option name Hash type spin default %d min 1 max %d" % (DEFAULT_HASH_MB, MAX_HASH_MB))
+            self.send("option name Threads type spin default 1 min 1 max %d" % MAX_THREADS)
+            self.send("option name Ponder type check default false")
+            self.send("option name OwnBook type check default false")
+            self.send("option name BookFile type string default <empty>")
+            self.send("option name TablebasePath type string default <empty>")
+            self.send("option name Backend type combo default mailbox "+" ".join("var "+name for name in sorted(BACKENDS)))
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "stop":
+            self.stop()
+        elif command == "ponderhit":
+            self.ponderhit()
+        elif command == "setoption":
+            self.wait()
+            self.set_option(args)
+        elif command == "ucinewgame":
+            self.wait()
+            self.state.transposition_table.clear()
+            self.state.history = [[0]*120 for _ in range(14)]
+        elif command == "position":
+            self.wait()
+            try:
+                self.set_position(args)
+            except (ValueError, IndexError) as error:
+                self.send("info string invalid position: %s" % (str(error) or " ".join(args)))
+        elif command == "go":
+            self.wait()
+            try:
+                limits, ponder, infinite = parse_go(args)
+            except ValueError:
+                self.send("info string invalid go command")
+                return True
+            self.go(limits, ponder, infinite)
+        return True
+
+    def set_option(self, args):
+        if "name" not in args:
+            return
+        if "value" in args:
+            name = " ".join(args[args.index("name")+1:args.index("value")]).lower()
+            value = " ".join(args[args.index("value")+1:])
+        else:
+            name, value = " ".join(args[args.index("name")+1:]).lower(), ""
+        try:
+            if name == "hash":
+                self.hash_size_mb = max(1, min(MAX_HASH_MB, int(value)))
+                self.state.transposition_table.resize(self.hash_size_mb)
+                self.close_pool()
+            elif name == "threads":
+                self.threads = max(1, min(MAX_THREADS, int(value)))
+                self.close_pool()
+            elif name == "backend" and value in BACKENDS:
+                fen = self.state.to_fen()
+                self.backend = value
+                book, tablebases = self.state.book, self.state.tablebases
+                self.state = GameState(self.hash_size_mb, self.backend)
+                self.state.set_fen(fen)
+                self.state.book, self.state.tablebases = book, tablebases
+                self.close_pool()
+            elif name == "ownbook":
+                self.own_book = value.lower() == "true"
+                self.open_book()
+            elif name == "bookfile":
+                self.book_file = "" if value == "<empty>" else value
+                self.open_book()
+            elif name == "tablebasepath":
+                if self.state.tablebases is not None:
+                    self.state.tablebases.close()
+                    self.state.tablebases = None
+                if value and value != "<empty>":
+                    if os.path.isdir(value):
+                        self.state.tablebases = Tablebases(value)
+                    else:
+                        self.send("info string no tablebase directory "+value)
+        except ValueError:
+            self.send("info string invalid value for %s: %s" % (name, value))
+
+    def open_book(self):
+        if self.state.book is not None:
+            self.state.book.close()
+            self.state.book = None
+        if self.own_book and self.book_file:
+            try:
+                self.state.book = OpeningBook(self.book_file)
+            except (OSError, ValueError) as error:
+                self.send("info string can't open book %s: %s" % (self.book_file, error))
+
+    def set_position(self, args):
+        if args and args[0] == "startpos":
+            fen, rest = START_FEN, args[1:]
+        elif args and args[0] == "fen":
+            end = args.index("moves") if "moves" in args else len(args)
+            fen, rest = " ".join(args[1:end]), args[end:]
+        else:
+            raise ValueError("expected startpos or fen")
+        # checked on a scratch state first, a rejected position leaves the current one in place
+        scratch = GameState(0)
+        scratch.set_fen(fen)
+        scratch.check_position()
+        for move in rest[1:]:
+            if move not in scratch.next_legal_moves():
+                raise ValueError("illegal move "+move)
+            scratch.make_move(move)
+        state = self.state
+        state.set_fen(fen)
+        for move in rest[1:]:
+            state.make_move(move)
+
+    def go(self, limits, ponder, infinite):
+        self.release.clear()
+        self.stop_event.clear()
+        self.state.stop_event = self.stop_event
+        self.ponder_limits = None
+        if ponder:
+            # think on the opponent's time without a clock, it only starts running with ponderhit
+            self.ponder_limits = {key: value for key, value in limits.items() if key in TIME_LIMITS}
+            limits = {key: value for key, value in limits.items() if key not in TIME_LIMITS}
+        elif not infinite:
+            self.release.set()
+        if self.threads > 1 and self.pool is None:
+            self.pool = SearchPool(self.threads, self.hash_size_mb, self.backend)
+        self.search_thread = threading.Thread(target=self.think, args=(limits,), daemon=True)
+        self.search_thread.start()
+
+    def think(self, limits):
+        state = self.state
+        is_whites_turn = state.is_whites_turn
+        start = time.monotonic()
+        def report(iteration, variation):
+            seconds = time.monotonic()-start
+            self.send("info depth %d score %s nodes %d nps %d time %d" % (
+                iteration["depth"], format_score(iteration["score"], is_whites_turn), iteration["nodes"],
+                iteration["nodes"]/seconds if seconds > 0 else 0, seconds*1000)+(" pv "+" ".join(variation) if variation else ""))
+            return variation
+        move, variation = "", []
+        try:
+            if self.pool is not None:
+                iterations = []
+                def on_iteration(iteration):
+                    iterations.append((iteration["depth"], report(iteration, iteration["pv"])))
+                move, value, depth = self.pool.search(state, on_iteration=on_iteration, **limits)
+                if iterations and iterations[-1][0] == depth:
+                    variation = iterations[-1][1]
+                elif move and depth:
+                    # the last depth can finish after the progress of the workers was read
+                    variation = report({"depth": depth, "move": move, "score": value, "nodes": self.pool.nodes}, [move])
+            else:
+                iterations = []
+                def on_iteration(iteration):
+                    iterations.append(report(iteration, state.principal_variation(iteration["move"])))
+                move, value, depth = state.search(on_iteration=on_iteration, **limits)
+                variation = iterations[-1] if iterations else []
+        except Exception as error:
+            # the gui waits for a bestmove whatever happened
+            self.send("info string search failed: %s" % error)
+        finally:
+            self.release.wait()
+            if self.stop_timer is not None:
+                self.stop_timer.cancel()
+                self.stop_timer = None
+            if not move:
+                self.send("bestmove 0000")
+            elif len(variation) > 1 and variation[0] == move:
+                self.send("bestmove %s ponder %s" % (move, variation[1]))
+            else:
+                self.send("bestmove "+move)
+
+    def stop(self):
+        if self.stop_timer is not None:
+            self.stop_timer.cancel()
+        self.stop_event.set()
+        if self.pool is not None:
+            self.pool.stop()
+        self.release.set()
+
+    def ponderhit(self):
+        # the predicted move was played, the running search becomes a normal one and gets a deadline
+        limits, self.ponder_limits = self.ponder_limits, None
+        if limits is None:
+            return
+        budget = self.state.allocate_time(**limits)
+        if budget is not None:
+            self.stop_timer = threading.Timer(budget, self.stop)
+            self.stop_timer.daemon = True
+            self.stop_timer.start()
+        self.release.set()
+
+    def wait(self):
+        if self.search_thread is not None:
+            self.search_thread.join()
+            self.search_thread = None
+
+    def close_pool(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+
+    def quit(self):
+        self.stop()
+        self.wait()
+        self.close_pool()
+        if self.state.book is not None:
+            self.state.book.close()
+        if self.state.tablebases is not None:
+            self.state.tablebases.close()
+
+def main():
+    UciEngine().run()
+
+if __name__ == "__main__":
+    main()